@@ -0,0 +1,229 @@
+"""Benchmark the generator on synthetic catalogs
+
+Builds catalogs of the requested sizes straight from the snapshot classes of
+the plugin, so MySQL Workbench is not needed, and times each phase of an
+export. Results are printed as a table and written as JSON, e.g.:
+
+    python benchmarks/benchmark.py --tables 10,100,1000,10000 -o results.json
+"""
+import importlib.util
+import argparse
+import datetime
+import platform
+import tempfile
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+pluginPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generate-laravel-migrations.py')
+
+# (type name, type group, length, precision, scale, explicit params)
+columnTypes = [
+    ('VARCHAR', 'string', 255, -1, -1, ''),
+    ('VARCHAR', 'string', 100, -1, -1, ''),
+    ('INT', 'numeric', -1, -1, -1, ''),
+    ('DECIMAL', 'numeric', -1, 10, 2, ''),
+    ('TEXT', 'text', -1, -1, -1, ''),
+    ('DATETIME', 'datetime', -1, -1, -1, ''),
+    ('TINYINT', 'numeric', -1, 1, -1, ''),
+    ('ENUM', 'string', -1, -1, -1, "('draft','published')"),
+    ('CHAR', 'string', 36, -1, -1, ''),
+    ('JSON', 'various', -1, -1, -1, ''),
+]
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location('generate_laravel_migrations', pluginPath)
+    plugin = importlib.util.module_from_spec(spec)
+    # Registered so that --jobs can pickle the plugin's functions
+    sys.modules[spec.name] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+def synthetic_schema(plugin, tables, columns=8, indexes=2, fk_density=1.0, chain_depth=5, cycles=0, seed=1):
+    """Build a schema of tables referencing each other chain_depth levels deep
+
+    Every table gets an id, columns extra columns and indexes indexes. Tables
+    reference on average fk_density tables of the level above them, and cycles
+    tables at the top of a chain of references reference back to the table of
+    the last level the chain starts from, closing that many circular references.
+    """
+    rng = random.Random(seed)
+    chain_depth = max(1, min(chain_depth, tables))
+    levels = [[] for _ in range(chain_depth)]
+    schema = plugin.Schema(name='benchmark', tables=[])
+
+    for i in range(tables):
+        name = 'table_{:05}'.format(i)
+        tbl = plugin.Table(name=name, engine='InnoDB', columns=[], indices=[], foreign_keys=[], primary_column='id',
+                           row_format='', charset='', collation='', auto_increment='', key_block_size='',
+                           partitioning=None)
+        tbl.columns.append(column(plugin, 'id', ('BIGINT', 'numeric', -1, -1, -1, ''), not_null=1))
+        tbl.indices.append(plugin.Index(name='PRIMARY', index_type='PRIMARY', is_primary=1, columns=['id']))
+
+        for c in range(columns):
+            definition = columnTypes[rng.randrange(len(columnTypes))]
+            tbl.columns.append(column(
+                plugin, 'column_{}'.format(c), definition,
+                not_null=rng.randrange(2),
+                default_value="'x'" if definition[1] == 'string' and rng.random() < 0.2 else '',
+                comment="The column's comment" if rng.random() < 0.3 else ''
+            ))
+
+        for x in range(min(indexes, columns)):
+            if x % 2 == 0:
+                tbl.indices.append(plugin.Index(name='{}_unique_{}'.format(name, x), index_type='UNIQUE',
+                                                is_primary=0, columns=['column_{}'.format(x)]))
+            elif x + 1 < columns:
+                tbl.indices.append(plugin.Index(name='{}_index_{}'.format(name, x), index_type='INDEX', is_primary=0,
+                                                columns=['column_{}'.format(x), 'column_{}'.format(x + 1)]))
+
+        level = i % chain_depth
+        if level > 0:
+            references = int(fk_density) + (1 if rng.random() < fk_density % 1 else 0)
+            for referenced in rng.sample(levels[level - 1], min(references, len(levels[level - 1]))):
+                reference(plugin, tbl, referenced)
+
+        levels[level].append(tbl)
+        schema.tables.append(tbl)
+
+    if chain_depth > 1 and cycles > 0:
+        # The first table each table references, taken before any cycle is closed
+        tables_by_name = dict((tbl.name, tbl) for tbl in schema.tables)
+        parents = dict((tbl.name, tables_by_name[tbl.foreign_keys[0].referenced_table])
+                       for tbl in schema.tables if tbl.foreign_keys)
+        # Cycles share no table, so that each takes a foreign key to break
+        cycle_tables = set()
+        closed = 0
+        for tbl in rng.sample(levels[-1], len(levels[-1])):
+            # Follow the references of the table as far up as they go
+            chain = [tbl.name]
+            while chain[-1] in parents:
+                chain.append(parents[chain[-1]].name)
+
+            if len(chain) > 1 and cycle_tables.isdisjoint(chain):
+                cycle_tables.update(chain)
+                reference(plugin, tables_by_name[chain[-1]], tbl)
+                closed += 1
+                if closed == cycles:
+                    break
+
+    return schema
+
+
+def column(plugin, name, definition, not_null=0, default_value='', comment=''):
+    type_name, type_group, length, precision, scale, explicit_params = definition
+    return plugin.Column(name=name, type_name=type_name, type_group=type_group, flags=[], length=length,
+                         precision=precision, scale=scale, is_not_null=not_null, default_value=default_value,
+                         default_value_is_null=0, comment=comment, explicit_params=explicit_params)
+
+
+def reference(plugin, tbl, referenced):
+    name = '{}_id'.format(referenced.name)
+    if name in [col.name for col in tbl.columns]:
+        return
+
+    tbl.columns.append(plugin.Column(name=name, type_name='BIGINT', type_group='numeric', flags=['UNSIGNED'],
+                                     length=-1, precision=-1, scale=-1, is_not_null=1, default_value='',
+                                     default_value_is_null=0, comment='', explicit_params=''))
+    tbl.indices.append(plugin.Index(name='fk_{}_{}_idx'.format(tbl.name, name), index_type='INDEX', is_primary=0,
+                                    columns=[name]))
+    tbl.foreign_keys.append(plugin.ForeignKey(
+        name='fk_{}_{}'.format(tbl.name, name), columns=[name], referenced_table=referenced.name,
+        referenced_columns=['id'], index_name='fk_{}_{}_idx'.format(tbl.name, name), update_rule='CASCADE',
+        delete_rule='CASCADE'
+    ))
+
+
+def timed(phases, phase, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    phases[phase] = time.perf_counter() - start
+    return result
+
+
+def preview(plugin, texts):
+    """What the wizard does to open its preview: list every migration, then show the first"""
+    now = datetime.datetime.now()
+    rows = [(migration.table, plugin.migration_file_name(now, 0, migration.name)) for migration, text in texts]
+    return rows, texts[0][1]
+
+
+def run_export(plugin, schema, jobs=1):
+    """Run each phase of an export of schema once, returning their times and the output size"""
+    phases = {}
+    tables = timed(phases, 'indexing', plugin.catalog_tables, [schema])
+    table_tree, deferred_references = timed(phases, 'ordering', plugin.create_tree, tables, True)
+    migrations = timed(phases, 'planning', plugin.plan_tables, tables, table_tree, deferred_references)
+    texts = timed(phases, 'rendering', list, plugin.generate_migrations(migrations, jobs))
+
+    # The wizard opens its preview once the migrations are rendered; laying
+    # out its rows and editor is left to mforms and not timed
+    timed(phases, 'preview', preview, plugin, texts)
+
+    path = tempfile.mkdtemp(prefix='laravel-migrations-benchmark-')
+    try:
+        timed(phases, 'saving', plugin.save_migrations, path, iter(texts))
+        timed(phases, 'resaving', plugin.save_migrations, path, iter(texts))
+    finally:
+        shutil.rmtree(path)
+
+    return phases, len(migrations), sum(len(text) for migration, text in texts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the generator on synthetic catalogs.')
+    parser.add_argument('--tables', default='10,100,1000',
+                        help='comma separated catalog sizes to benchmark (default: 10,100,1000)')
+    parser.add_argument('--columns', type=int, default=8, help='columns per table besides the id (default: 8)')
+    parser.add_argument('--indexes', type=int, default=2, help='indexes per table (default: 2)')
+    parser.add_argument('--fk-density', type=float, default=1.0,
+                        help='average number of foreign keys per table (default: 1.0)')
+    parser.add_argument('--chain-depth', type=int, default=5, help='levels of tables referencing each other')
+    parser.add_argument('--cycles', type=int, default=0, help='number of circular references to add')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic catalogs (default: 1)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='processes rendering migrations (default: 1)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per size, of which the fastest time of each phase is kept (default: 3)')
+    parser.add_argument('-o', '--output', help='file to write the JSON results to (default: standard output)')
+    args = parser.parse_args(argv)
+
+    plugin = load_plugin()
+    results = []
+    for size in [int(size) for size in args.tables.split(',')]:
+        schema = synthetic_schema(plugin, size, args.columns, args.indexes, args.fk_density, args.chain_depth,
+                                  args.cycles, args.seed)
+        best = {}
+        for _ in range(args.repeat):
+            phases, migrations, size_bytes = run_export(plugin, schema, args.jobs)
+            for phase, seconds in phases.items():
+                best[phase] = min(best.get(phase, seconds), seconds)
+
+        results.append({'tables': size, 'migrations': migrations, 'bytes': size_bytes, 'seconds': best})
+        sys.stderr.write('{:>7} tables  {}\n'.format(
+            size, '  '.join('{} {:.4f}s'.format(phase, seconds) for phase, seconds in best.items())
+        ))
+
+    report = {
+        'plugin_version': plugin.pluginVersion,
+        'python': platform.python_version(),
+        'parameters': dict((k, v) for k, v in vars(args).items() if k != 'output'),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,17 +4,38 @@
 # Written in MySQL Workbench 6.3.6
 # Support for MySQL Workbench 8.0 added
 
-from io import StringIO
-import glob
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, replace
+import xml.etree.ElementTree as ElementTree
+import argparse
+import cProfile
+import concurrent.futures
+import ctypes.util
+import threading
+import hashlib
+import select
+import struct
+import sqlite3
+import zipfile
+import json
+import time
+import sys
+import os
 
-import grt
-import mforms
 import datetime
 
+try:
+    import grt
+    import mforms
 
-from wb import DefineModule, wbinputs
-from workbench.ui import WizardForm, WizardPage
-from mforms import newButton, newCodeEditor, FileChooser
+    from wb import DefineModule, wbinputs
+    from workbench.ui import WizardForm, WizardPage
+    from mforms import newButton, newCodeEditor, FileChooser, Form
+except ImportError:
+    # Running headless, outside of MySQL Workbench
+    grt = None
+    WizardForm = WizardPage = Form = object
 
 typesDict = {
     'BIG_INCREMENTS': 'bigIncrements',
@@ -92,8 +113,62 @@ typesDict = {
     'UUID': 'uuid'
 }
 
-migrations = {}
-migration_tables = []
+# Types promoted when their column is the primary key; others become INCREMENTS
+primaryColumnTypes = {
+    'BIGINT': 'BIG_INCREMENTS',
+    'MEDIUMINT': 'MEDIUM_INCREMENTS',
+    'VARCHAR': 'VARCHAR',
+    'CHAR': 'CHAR',
+}
+
+# Types with an unsigned counterpart in typesDict (u<TYPE>)
+unsignedColumnTypes = frozenset(['BIGINT', 'INT', 'TINYINT', 'MEDIUMINT', 'SMALLINT'])
+
+defaultTimeValues = frozenset([
+    'CURRENT_TIMESTAMP',
+    'NULL ON UPDATE CURRENT_TIMESTAMP',
+    'CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'
+])
+
+# GRT structs read from a .mwb document; everything else in it is skipped
+documentStructs = (
+    'db.mysql.Schema', 'db.mysql.Table', 'db.mysql.Column', 'db.mysql.Index', 'db.mysql.IndexColumn',
+    'db.mysql.ForeignKey', 'db.mysql.PartitionDefinition', 'db.UserDatatype'
+)
+
+# Datatype groups of the MySQL simple datatypes, which a .mwb file only
+# references by id (com.mysql.rdbms.mysql.datatype.<name>)
+simpleDatatypeGroups = {
+    'numeric': ['TINYINT', 'SMALLINT', 'MEDIUMINT', 'INT', 'BIGINT', 'FLOAT', 'REAL', 'DOUBLE', 'DECIMAL', 'BIT',
+                'BOOLEAN'],
+    'string': ['CHAR', 'NCHAR', 'VARCHAR', 'NVARCHAR', 'BINARY', 'VARBINARY'],
+    'text': ['TINYTEXT', 'TEXT', 'MEDIUMTEXT', 'LONGTEXT'],
+    'blob': ['TINYBLOB', 'BLOB', 'MEDIUMBLOB', 'LONGBLOB'],
+    'datetime': ['DATETIME', 'DATETIME_F', 'DATE', 'DATE_F', 'TIME', 'TIME_F', 'TIMESTAMP', 'TIMESTAMP_F', 'YEAR'],
+    'gis': ['GEOMETRY', 'POINT', 'LINESTRING', 'POLYGON', 'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON',
+            'GEOMETRYCOLLECTION'],
+    'various': ['ENUM', 'SET', 'JSON'],
+}
+
+pluginVersion = '1.4.0'
+
+# Kept next to the saved migrations, fingerprinting what each was generated from
+manifestFileName = '.laravel-migrations.json'
+
+# Kept next to the saved migrations, the tables they were generated from
+snapshotFileName = '.laravel-migrations-snapshot.json'
+
+# Seconds between two updates of the progress dialog from the export worker
+progressPollInterval = 0.1
+
+# Number of migrations each process renders ahead
+renderAheadSize = 16
+
+# Size in megabytes the render cache is trimmed to after each run
+renderCacheSize = 64
+
+# Render cache of the wizard, in the user data folder of MySQL Workbench
+renderCacheFileName = 'laravel-migrations-cache.sqlite'
 migrationTemplate = '''<?php
 
 /**
@@ -154,435 +229,2439 @@ migrationEndingTemplate = '''        Schema::dropIfExists('{tableName}');
 }};
 '''
 
-ModuleInfo = DefineModule(
-    name='GenerateLaravelMigrations',
-    author='Carlos Herrera (caherrera), Pat Gagnon-Renaud (eXolnet), Brandon Eckenrode (beckenrode)',
-    version='1.4.0'
-)
+deferredForeignKeysMigrationName = 'add_deferred_foreign_keys'
 
+# Diff mode changes foreign keys around every other change of the tables
+droppedForeignKeysMigrationName = 'drop_changed_foreign_keys'
+addedForeignKeysMigrationName = 'add_changed_foreign_keys'
 
-@ModuleInfo.plugin(
-    'wb.util.generate_laravel_migrations',
-    caption='Generate Laravel Migrations',
-    input=[wbinputs.currentCatalog()],
-    groups=['Catalog/Utilities', 'Menu/Catalog'],
-    pluginMenu='Catalog'
-)
-@ModuleInfo.export(grt.INT, grt.classes.db_Catalog)
-def generate_laravel_migrations(catalog):
-    def create_tree(table_schema):
-        tree = {}
-        for tbl in sorted(table_schema.tables, key=lambda table: table.name):
-            table_references = []
-
-            for key in tbl.foreignKeys:
-                if key.name != '' and hasattr(key, 'referencedColumns') and len(
-                        key.referencedColumns) > 0 and tbl.name != key.referencedColumns[0].owner.name:
-                    table_references.append(key.referencedColumns[0].owner.name)
-
-            tree[tbl.name] = table_references
-
-        d = dict((k, set(tree[k])) for k in tree)
-        r = []
-        i = 0
-        while d:
-            # values not in keys (items without dep)
-            t = set(i for v in d.values() for i in v) - set(d.keys())
-            # and keys without value (items without dep)
-            t.update(k for k, v in d.items() if not v)
-            # can be done right away
-            r.append(t)
-            # and cleaned up
-            d = dict(((k, v - t) for k, v in d.items() if v))
-
-            i += 1
-            if i > 9999:
-                raise GenerateLaravelMigrationsException(
-                    'Circular reference detected!',
-                    'Unfortunately, circular references are not supported. Find and remove the circular reference(s) and try again.'
+squashedMigrationName = 'create_database_schema'
+
+# Ways the wizard can lay the migrations out
+migrationLayouts = ['One migration per table', 'One migration per dependency level', 'Single migration']
+
+migrationHeaderTemplate = '''<?php
+
+/**
+ * Created using Mysql Workbench.
+ * Avoid edit this file
+ *
+ */
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     *
+     * @return void
+     */
+    public function up()
+    {
+'''
+
+schemaTableTemplate = '''        Schema::table('{tableName}', function (Blueprint $table) {{
+'''
+
+dropForeignKeyTemplate = '''            $table->dropForeign(['{foreignKey}']);
+'''
+
+createTableTemplate = '''        Schema::create('{tableName}', function (Blueprint $table) {{
+'''
+
+dropTableTemplate = '''        Schema::dropIfExists('{tableName}');
+'''
+
+dropColumnTemplate = '''            $table->dropColumn('{columnName}');
+'''
+
+dropIndexTemplate = '''            $table->{dropMethod}([{indexColumns}]);
+'''
+
+disableForeignKeysTemplate = '''        Schema::disableForeignKeyConstraints();
+'''
+
+enableForeignKeysTemplate = '''        Schema::enableForeignKeyConstraints();
+'''
+
+tableStatementTemplate = '''
+        DB::statement('ALTER TABLE `{tableName}` {options}');
+'''
+
+dropIndexMethods = {'unique': 'dropUnique', 'index': 'dropIndex', 'fulltext': 'dropFullText'}
+
+saveSummaryTemplate = '{written} written, {skipped} skipped (unchanged), {created} created, {removed} removed'
+
+# InnoDB limit on the length of an index key with the DYNAMIC row format, and
+# the bytes a character of utf8mb4, Laravel's default charset, may take up
+indexKeyMaxBytes = 3072
+utf8mb4CharBytes = 4
+
+# Length Laravel gives string columns created without one
+defaultStringLength = 255
+
+# Errors reading a file that is not a (complete) MySQL Workbench model
+modelReadErrors = (IOError, OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError)
+
+# Seconds between two checks of the watched models when polling, and the
+# default seconds a watched model has to stay untouched before it is exported
+watchPollInterval = 0.5
+watchDebounce = 0.2
+
+# inotify_event header, and the events of a file being saved in place or
+# moved over (IN_CLOSE_WRITE | IN_MOVED_TO)
+inotifyEvent = struct.Struct('iIII')
+inotifyMask = 0x00000008 | 0x00000080
+
+# Number of slowest tables the export metrics list
+slowestTablesCount = 10
+
+exportCounters = OrderedDict([
+    ('grt_reads', 'GRT reads'),
+    ('tables_rendered', 'tables rendered'),
+    ('cache_hits', 'cache hits'),
+    ('files_written', 'files written'),
+    ('bytes_written', 'bytes written'),
+])
+
+
+@dataclass
+class Column(object):
+    __slots__ = ('name', 'type_name', 'type_group', 'flags', 'length', 'precision', 'scale', 'is_not_null',
+                 'default_value', 'default_value_is_null', 'comment', 'explicit_params')
+    name: str
+    type_name: str
+    type_group: str
+    flags: list
+    length: int
+    precision: int
+    scale: int
+    is_not_null: int
+    default_value: str
+    default_value_is_null: int
+    comment: str
+    explicit_params: str
+
+
+@dataclass
+class Index(object):
+    __slots__ = ('name', 'index_type', 'is_primary', 'columns')
+    name: str
+    index_type: str
+    is_primary: int
+    columns: list
+
+
+@dataclass
+class ForeignKey(object):
+    __slots__ = ('name', 'columns', 'referenced_table', 'referenced_columns', 'index_name', 'update_rule',
+                 'delete_rule')
+    name: str
+    columns: list
+    referenced_table: str
+    referenced_columns: list
+    index_name: str
+    update_rule: str
+    delete_rule: str
+
+
+@dataclass
+class PartitionDefinition(object):
+    __slots__ = ('name', 'value')
+    name: str
+    value: str
+
+
+@dataclass
+class Partitioning(object):
+    __slots__ = ('partition_type', 'expression', 'count', 'subpartition_type', 'subpartition_expression',
+                 'subpartition_count', 'definitions')
+    partition_type: str
+    expression: str
+    count: int
+    subpartition_type: str
+    subpartition_expression: str
+    subpartition_count: int
+    definitions: list
+
+
+@dataclass
+class Table(object):
+    __slots__ = ('name', 'engine', 'columns', 'indices', 'foreign_keys', 'primary_column', 'row_format', 'charset',
+                 'collation', 'auto_increment', 'key_block_size', 'partitioning')
+    name: str
+    engine: str
+    columns: list
+    indices: list
+    foreign_keys: list
+    primary_column: str
+    row_format: str
+    charset: str
+    collation: str
+    auto_increment: str
+    key_block_size: str
+    partitioning: Partitioning
+
+
+@dataclass
+class Schema(object):
+    __slots__ = ('name', 'tables')
+    name: str
+    tables: list
+
+
+@dataclass
+class Migration(object):
+    """A planned migration, rendered by calling renderer with the definition"""
+    __slots__ = ('table', 'name', 'fingerprint', 'renderer', 'definition')
+    table: str
+    name: str
+    fingerprint: str
+    renderer: object
+    definition: tuple
+
+
+@dataclass
+class Advice(object):
+    """A performance hazard the advisor found in a table"""
+    __slots__ = ('table', 'kind', 'message')
+    table: str
+    kind: str
+    message: str
+
+
+def snapshot_catalog(catalog):
+    """Copy a db_Catalog into plain objects, reading each GRT attribute once"""
+    return [snapshot_schema(schema) for schema in catalog.schemata]
+
+
+def snapshot_schema(schema):
+    return Schema(name=schema.name, tables=[snapshot_table(tbl) for tbl in schema.tables])
+
+
+def snapshot_table(tbl):
+    indices = []
+    primary_column = None
+    for index in tbl.indices:
+        is_primary = index.isPrimary
+        columns = [column.referencedColumn.name for column in index.columns]
+        if is_primary == 1 and primary_column is None and len(columns) > 0:
+            primary_column = columns[0]
+
+        indices.append(Index(name=index.name, index_type=index.indexType, is_primary=is_primary, columns=columns))
+
+    foreign_keys = []
+    for key in tbl.foreignKeys:
+        referenced_columns = key.referencedColumns if hasattr(key, 'referencedColumns') else []
+        key_index = key.index
+        foreign_keys.append(ForeignKey(
+            name=key.name,
+            columns=[column.name for column in key.columns],
+            referenced_table=referenced_columns[0].owner.name if len(referenced_columns) > 0 else None,
+            referenced_columns=[column.name for column in referenced_columns],
+            index_name=key_index.name if hasattr(key_index, 'name') else None,
+            update_rule=key.updateRule,
+            delete_rule=key.deleteRule
+        ))
+
+    partitioning = None
+    partition_type = tbl.partitionType
+    if partition_type:
+        partitioning = Partitioning(
+            partition_type=partition_type,
+            expression=tbl.partitionExpression,
+            count=tbl.partitionCount,
+            subpartition_type=tbl.subpartitionType,
+            subpartition_expression=tbl.subpartitionExpression,
+            subpartition_count=tbl.subpartitionCount,
+            definitions=[PartitionDefinition(name=definition.name, value=definition.value)
+                         for definition in tbl.partitionDefinitions]
+        )
+
+    return Table(
+        name=tbl.name,
+        engine=tbl.tableEngine,
+        columns=[snapshot_column(col) for col in tbl.columns],
+        indices=indices,
+        foreign_keys=foreign_keys,
+        primary_column=primary_column,
+        row_format=tbl.rowFormat,
+        charset=tbl.defaultCharacterSetName,
+        collation=tbl.defaultCollationName,
+        auto_increment=tbl.nextAutoInc,
+        key_block_size=tbl.keyBlockSize,
+        partitioning=partitioning
+    )
+
+
+def snapshot_column(col):
+    # Name is important attribute so it has to be set
+    # in order to make this work
+    # https://github.com/beckenrode/mysql-workbench-export-laravel-5-migrations/issues/18#issuecomment-272152778
+    try:
+        data_type = col.simpleType if col.simpleType else col.userType
+        type_name = data_type.name
+        type_group = data_type.group.name
+    except AttributeError:
+        # Columns without a usable datatype are skipped by the generator
+        type_name = type_group = None
+
+    return Column(
+        name=col.name,
+        type_name=type_name,
+        type_group=type_group,
+        flags=list(col.flags),
+        length=col.length,
+        precision=col.precision,
+        scale=col.scale,
+        is_not_null=col.isNotNull,
+        default_value=col.defaultValue,
+        default_value_is_null=col.defaultValueIsNull,
+        comment=col.comment,
+        explicit_params=col.datatypeExplicitParams
+    )
+
+
+def load_mwb(path):
+    """Read the catalog of a MySQL Workbench model file into snapshot objects"""
+    with zipfile.ZipFile(path) as archive:
+        with archive.open('document.mwb.xml') as document:
+            return parse_document(document)
+
+
+def parse_document(document):
+    # Objects are flattened into records as soon as their element ends and the
+    # element is emptied right away, so memory follows the size of the schema
+    # rather than the document; id links are resolved once parsing is done.
+    objects = {}
+    schemata = []
+    parents = []
+    for event, element in ElementTree.iterparse(document, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag != 'value' or element.get('type') != 'object':
+            # Plain values and lists are read along with the object owning them
+            continue
+
+        struct_name = element.get('struct-name')
+        if struct_name in documentStructs:
+            object_id = element.get('id')
+            objects[object_id] = grt_object(element)
+            if struct_name == 'db.mysql.Schema':
+                schemata.append(object_id)
+
+            # The owning object's list only needs the id
+            element.clear()
+            element.set('type', 'object')
+            element.set('id', object_id)
+        elif parents:
+            # Diagrams, figures, layers and everything else the generator never
+            # uses are dropped from the tree as they go
+            del parents[-1][-1]
+
+    return [document_schema(objects, objects[schema_id]) for schema_id in schemata]
+
+
+def grt_object(element):
+    record = {}
+    for child in element:
+        key = child.get('key')
+        value_type = child.get('type')
+        if key is None:
+            continue
+
+        if child.tag == 'link' or value_type == 'object':
+            record[key] = child.text if child.tag == 'link' else child.get('id')
+        elif value_type == 'list':
+            record[key] = [item.get('id') if item.tag == 'value' and item.get('type') == 'object' else item.text
+                           for item in child]
+        elif value_type == 'int':
+            record[key] = int(child.text)
+        elif value_type == 'string':
+            record[key] = child.text or ''
+
+    return record
+
+
+def document_schema(objects, schema):
+    return Schema(name=schema['name'], tables=[
+        document_table(objects, objects[table_id]) for table_id in schema.get('tables', []) if table_id in objects
+    ])
+
+
+def document_table(objects, tbl):
+    def column_name(column_id):
+        return objects[column_id]['name']
+
+    indices = []
+    primary_column = None
+    for index in [objects[index_id] for index_id in tbl.get('indices', [])]:
+        columns = [column_name(objects[column_id]['referencedColumn']) for column_id in index.get('columns', [])]
+        if index['isPrimary'] == 1 and primary_column is None and len(columns) > 0:
+            primary_column = columns[0]
+
+        indices.append(Index(name=index['name'], index_type=index['indexType'], is_primary=index['isPrimary'],
+                             columns=columns))
+
+    foreign_keys = []
+    for key in [objects[key_id] for key_id in tbl.get('foreignKeys', [])]:
+        referenced_columns = [column_id for column_id in key.get('referencedColumns', []) if column_id in objects]
+        key_index = objects.get(key.get('index'))
+        foreign_keys.append(ForeignKey(
+            name=key['name'],
+            columns=[column_name(column_id) for column_id in key.get('columns', [])],
+            referenced_table=objects[objects[referenced_columns[0]]['owner']]['name'] if referenced_columns else None,
+            referenced_columns=[column_name(column_id) for column_id in referenced_columns],
+            index_name=key_index['name'] if key_index is not None else None,
+            update_rule=key.get('updateRule', ''),
+            delete_rule=key.get('deleteRule', '')
+        ))
+
+    partitioning = None
+    if tbl.get('partitionType'):
+        partitioning = Partitioning(
+            partition_type=tbl['partitionType'],
+            expression=tbl.get('partitionExpression', ''),
+            count=tbl.get('partitionCount', 0),
+            subpartition_type=tbl.get('subpartitionType', ''),
+            subpartition_expression=tbl.get('subpartitionExpression', ''),
+            subpartition_count=tbl.get('subpartitionCount', 0),
+            definitions=[
+                PartitionDefinition(name=objects[definition_id]['name'], value=objects[definition_id].get('value', ''))
+                for definition_id in tbl.get('partitionDefinitions', []) if definition_id in objects
+            ]
+        )
+
+    return Table(
+        name=tbl['name'],
+        engine=tbl.get('tableEngine', ''),
+        columns=[document_column(objects, objects[column_id]) for column_id in tbl.get('columns', [])],
+        indices=indices,
+        foreign_keys=foreign_keys,
+        primary_column=primary_column,
+        row_format=tbl.get('rowFormat', ''),
+        charset=tbl.get('defaultCharacterSetName', ''),
+        collation=tbl.get('defaultCollationName', ''),
+        auto_increment=tbl.get('nextAutoInc', ''),
+        key_block_size=tbl.get('keyBlockSize', ''),
+        partitioning=partitioning
+    )
+
+
+def document_column(objects, col):
+    type_name = type_group = None
+    if col.get('simpleType'):
+        type_name = col['simpleType'].rsplit('.', 1)[-1].upper()
+        type_group = simple_datatype_group(type_name)
+    elif col.get('userType') in objects:
+        user_type = objects[col['userType']]
+        type_name = user_type['name']
+        type_group = simple_datatype_group(user_type.get('actualType', '').rsplit('.', 1)[-1].upper())
+
+    return Column(
+        name=col['name'],
+        type_name=type_name,
+        type_group=type_group,
+        flags=col.get('flags', []),
+        length=col.get('length', -1),
+        precision=col.get('precision', -1),
+        scale=col.get('scale', -1),
+        is_not_null=col.get('isNotNull', 0),
+        default_value=col.get('defaultValue', ''),
+        default_value_is_null=col.get('defaultValueIsNull', 0),
+        comment=col.get('comment', ''),
+        explicit_params=col.get('datatypeExplicitParams', '')
+    )
+
+
+def simple_datatype_group(type_name):
+    for group, type_names in simpleDatatypeGroups.items():
+        if type_name in type_names:
+            return group
+    return 'userdefined'
+
+
+def catalog_tables(schemata):
+    """Index the tables of all schemata by name
+
+    Every schema is migrated into the same database, so a table name can only
+    be used once across the catalog.
+    """
+    tables = {}
+    duplicates = set()
+    for schema in schemata:
+        for tbl in schema.tables:
+            # Also across schemata of the same name, e.g. from two models
+            if tbl.name in tables:
+                duplicates.add(tbl.name)
+            tables[tbl.name] = tbl
+
+    if duplicates:
+        raise GenerateLaravelMigrationsException(
+            'Duplicate table name!',
+            'All schemata are migrated into the same database, so table names have to be unique across them. '
+            'Rename the following tables and try again: {}'.format(', '.join(sorted(duplicates)))
+        )
+
+    return tables
+
+
+def create_tree(tables, defer_cycles=False):
+    tree = {}
+    for tbl in sorted(tables.values(), key=lambda table: table.name):
+        table_references = []
+
+        for key in tbl.foreign_keys:
+            if key.name != '' and key.referenced_table is not None and tbl.name != key.referenced_table:
+                table_references.append(key.referenced_table)
+
+        tree[tbl.name] = table_references
+
+    deferred_references = set()
+    if defer_cycles:
+        deferred_references = cyclic_references(tree)
+        for name in tree:
+            tree[name] = [v for v in tree[name] if (name, v) not in deferred_references]
+
+    # Kahn's algorithm: in-degree counters plus an adjacency index
+    # (referenced table -> dependent tables), batched level by level
+    in_degree = {}
+    dependents = {}
+    for name, references in tree.items():
+        in_degree.setdefault(name, 0)
+        for reference in set(references):
+            in_degree.setdefault(reference, 0)
+            in_degree[name] += 1
+            dependents.setdefault(reference, []).append(name)
+
+    r = []
+    level = sorted(k for k, v in in_degree.items() if v == 0)
+    ordered = 0
+    while level:
+        r.append(level)
+        ordered += len(level)
+        next_level = []
+        for name in level:
+            for dependent in dependents.get(name, ()):
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    next_level.append(dependent)
+        level = sorted(next_level)
+
+    if ordered < len(in_degree):
+        raise CircularReferenceException(
+            'Circular reference detected!',
+            'Unfortunately, circular references are not supported. Find and remove the circular reference(s) '
+            'between the following tables and try again: {}'.format(', '.join(cycle_members(in_degree, dependents)))
+        )
+
+    return r, deferred_references
+
+
+def cyclic_references(tree):
+    # Tarjan's strongly connected components, iteratively to stay clear of
+    # the recursion limit on long reference chains
+    index = {}
+    low_link = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root in tree:
+        if root in index:
+            continue
+
+        work = [(root, iter(tree.get(root, ())))]
+        index[root] = low_link[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            name, references = work[-1]
+            for reference in references:
+                if reference not in index:
+                    index[reference] = low_link[reference] = len(index)
+                    stack.append(reference)
+                    on_stack.add(reference)
+                    work.append((reference, iter(tree.get(reference, ()))))
+                    break
+                elif reference in on_stack:
+                    low_link[name] = min(low_link[name], index[reference])
+            else:
+                work.pop()
+                if work:
+                    low_link[work[-1][0]] = min(low_link[work[-1][0]], low_link[name])
+
+                if low_link[name] == index[name]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == name:
+                            break
+                    if len(component) > 1:
+                        components.append(component)
+
+    # Within each cycle, defer only the references that point back up the
+    # current depth-first path; what is left of the component is acyclic.
+    deferred = set()
+    for component in components:
+        visited = set()
+        for root in sorted(component):
+            if root in visited:
+                continue
+
+            visited.add(root)
+            path = set([root])
+            work = [(root, iter(sorted(set(tree[root]) & component)))]
+            while work:
+                name, references = work[-1]
+                for reference in references:
+                    if reference in path:
+                        deferred.add((name, reference))
+                    elif reference not in visited:
+                        visited.add(reference)
+                        path.add(reference)
+                        work.append((reference, iter(sorted(set(tree[reference]) & component))))
+                        break
+                else:
+                    work.pop()
+                    path.discard(name)
+
+    return deferred
+
+
+def cycle_members(in_degree, dependents):
+    # Tables left with a positive in-degree are either on a cycle or only
+    # downstream of one; peel off the latter by repeatedly dropping tables
+    # no remaining table depends on.
+    remaining = set(k for k, v in in_degree.items() if v > 0)
+    out_degree = dict((k, 0) for k in remaining)
+    depends_on = dict((k, []) for k in remaining)
+    for name in remaining:
+        for dependent in dependents.get(name, ()):
+            if dependent in remaining:
+                out_degree[name] += 1
+                depends_on[dependent].append(name)
+
+    leaves = [k for k, v in out_degree.items() if v == 0]
+    while leaves:
+        name = leaves.pop()
+        remaining.discard(name)
+        for reference in depends_on[name]:
+            out_degree[reference] -= 1
+            if out_degree[reference] == 0:
+                leaves.append(reference)
+
+    return sorted(remaining)
+
+
+def addslashes(s):
+    replaces = ["\\", "'", "\0", ]
+    for i in replaces:
+        if i in s:
+            s = s.replace(i, '\\' + i)
+    return s
+
+
+def foreign_key_template(key):
+    delete_rule = key.delete_rule
+    if delete_rule == "":
+        delete_rule = "RESTRICT"
+
+    if delete_rule == 'CASCADE':
+        on_delete_method = '->cascadeOnDelete()'
+    elif delete_rule == 'RESTRICT' or delete_rule == 'NO ACTION':
+        on_delete_method = '->restrictOnDelete()'
+    elif delete_rule == 'SET NULL':
+        on_delete_method = '->nullOnDelete()'
+    else:
+        on_delete_method = "->onDelete('{onDeleteAction}')".format(onDeleteAction=delete_rule.lower())
+
+    update_rule = key.update_rule
+    if update_rule == "":
+        update_rule = "RESTRICT"
+
+    if update_rule == 'CASCADE':
+        on_update_method = '->cascadeOnUpdate()'
+    elif update_rule == 'RESTRICT' or update_rule == 'NO ACTION':
+        on_update_method = '->restrictOnUpdate()'
+    else:
+        on_update_method = "->onUpdate('{onUpdateAction}')".format(onUpdateAction=update_rule.lower())
+
+    return foreignKeyTemplate.format(
+        foreignKey=key.columns[0],
+        tableKeyName=key.referenced_columns[0],
+        foreignTableName=key.referenced_table,
+        onUpdateMethod=on_update_method,
+        onDeleteMethod=on_delete_method
+    )
+
+
+def plan_tables(tables, tree, deferred_references, existing_tables=()):
+    """Plan the migrations of tables in the order of tree
+
+    existing_tables are the names of tables created by earlier migrations.
+    """
+    foreign_keys = {}
+    deferred_keys = {}
+
+    created_tables = set(existing_tables)
+    migrations = []
+
+    # Sort every foreign key out up front, so that rendering a table only
+    # depends on the table itself and can be farmed out to other processes
+    ordered_tables = []
+    for reference_tables in tree:
+        for reference in reference_tables:
+            if reference not in tables:
+                continue
+
+            tbl = tables[reference]
+            table_name = tbl.name
+            created_tables.add(table_name)
+            table_foreign_keys = []
+
+            for key in tbl.foreign_keys:
+                if key.name != '' and key.index_name is not None:
+                    index_name = key.index_name
+                    foreign_key = key.columns[0]
+
+                    if index_name == 'PRIMARY':
+                        index_name = table_name + "_" + key.columns[0]
+
+                    if (table_name, key.referenced_table) in deferred_references:
+                        if table_name not in deferred_keys:
+                            deferred_keys[table_name] = []
+                        deferred_keys[table_name].append(key)
+
+                    elif key.referenced_table in created_tables:
+                        table_foreign_keys.append(key)
+
+                    else:
+                        if key.referenced_table not in foreign_keys:
+                            foreign_keys[key.referenced_table] = []
+
+                        foreign_keys[key.referenced_table].append({
+                            'table': table_name,
+                            'key': foreign_key,
+                            'name': index_name,
+                            'referenced_table': key.referenced_table,
+                            'referenced_name': key.referenced_columns[0],
+                            'update_rule': key.update_rule,
+                            'delete_rule': key.delete_rule
+                        })
+
+            ordered_tables.append((tbl, table_foreign_keys, list(foreign_keys.get(table_name, []))))
+
+    for definition in ordered_tables:
+        migrations.append(Migration(
+            table=definition[0].name,
+            name='create_{tableName}_table'.format(tableName=definition[0].name),
+            fingerprint=fingerprint(*definition),
+            renderer=render_table,
+            definition=definition
+        ))
+
+    if deferred_keys:
+        # Foreign keys closing a circular reference can only be added once
+        # every table on the cycle exists
+        migrations.append(Migration(
+            table=deferredForeignKeysMigrationName,
+            name=deferredForeignKeysMigrationName,
+            fingerprint=fingerprint(sorted(deferred_keys.items())),
+            renderer=render_deferred_foreign_keys,
+            definition=(deferred_keys,)
+        ))
+
+    return migrations
+
+
+def plan_diff(previous, tables, defer_cycles=False):
+    """Plan the migrations altering the previous tables into tables
+
+    Both map table names to tables, as catalog_tables and load_snapshot return
+    them. New tables get create migrations, changed tables update migrations
+    altering only what changed, and removed tables drop migrations.
+
+    Foreign keys may reference the columns and tables any of these change, so
+    the changed foreign keys of existing tables are dropped before the other
+    migrations run and added once they all ran. New tables are created after
+    the updates, whose columns and indexes their foreign keys may need.
+    """
+    migrations = []
+    dropped_keys = {}
+    added_keys = {}
+    for name in sorted(tables):
+        if name in previous:
+            dropped = changed_foreign_keys(previous[name], tables[name])
+            if dropped:
+                dropped_keys[name] = dropped
+            added = changed_foreign_keys(tables[name], previous[name])
+            if added:
+                added_keys[name] = added
+
+    if dropped_keys:
+        migrations.append(Migration(
+            table=droppedForeignKeysMigrationName,
+            name=droppedForeignKeysMigrationName,
+            fingerprint=fingerprint(sorted(dropped_keys.items())),
+            renderer=render_foreign_key_changes,
+            definition=(dropped_keys, {})
+        ))
+
+    # Drop tables before the tables they reference; each drop migration
+    # drops its own foreign keys first, which takes care of cycles
+    removed = dict((name, tbl) for name, tbl in previous.items() if name not in tables)
+    table_tree = create_tree(removed, True)[0]
+    for level in reversed(table_tree):
+        for name in level:
+            if name in removed:
+                migrations.append(Migration(
+                    table=name,
+                    name='drop_{tableName}_table'.format(tableName=name),
+                    fingerprint=fingerprint(removed[name]),
+                    renderer=render_table_drop,
+                    definition=(removed[name],)
+                ))
+
+    for name in sorted(tables):
+        # Tables can differ in ways migrations cannot express, e.g. the order
+        # of their columns; those would get empty update migrations
+        if name in previous and tables[name] != previous[name] and (
+                render_alterations(previous[name], tables[name]) or render_alterations(tables[name], previous[name])
+                or altered_table_options(previous[name], tables[name])
+                or altered_table_options(tables[name], previous[name])):
+            migrations.append(Migration(
+                table=name,
+                name='update_{tableName}_table'.format(tableName=name),
+                fingerprint=fingerprint(previous[name], tables[name]),
+                renderer=render_table_update,
+                definition=(previous[name], tables[name])
+            ))
+
+    added = dict((name, tbl) for name, tbl in tables.items() if name not in previous)
+    table_tree, deferred_references = create_tree(added, defer_cycles)
+    migrations.extend(plan_tables(added, table_tree, deferred_references, set(tables) - set(added)))
+
+    if added_keys:
+        migrations.append(Migration(
+            table=addedForeignKeysMigrationName,
+            name=addedForeignKeysMigrationName,
+            fingerprint=fingerprint(sorted(added_keys.items())),
+            renderer=render_foreign_key_changes,
+            definition=({}, added_keys)
+        ))
+
+    return migrations
+
+
+def plan_batches(tables, defer_cycles=False, batch_size=None, metrics=None):
+    """Plan one migration per dependency level of tables, or per batch_size tables
+
+    Every table of a batch is created after the tables it references, so its
+    foreign keys go in its Schema::create call instead of a separate ALTER.
+    """
+    if metrics is None:
+        metrics = ExportMetrics()
+
+    with metrics.phase('ordering'):
+        table_tree, deferred_references = create_tree(tables, defer_cycles)
+
+    with metrics.phase('planning'):
+        planned = plan_tables(tables, table_tree, deferred_references)
+        creates = [migration for migration in planned if migration.renderer is render_table]
+
+        if batch_size:
+            batches = [creates[i:i + batch_size] for i in range(0, len(creates), batch_size)]
+            name_format = 'create_tables_batch_{}'
+        else:
+            levels = dict((name, i) for i, level in enumerate(table_tree) for name in level)
+            batches = []
+            for migration in creates:
+                if batches and levels[batches[-1][-1].table] == levels[migration.table]:
+                    batches[-1].append(migration)
+                else:
+                    batches.append([migration])
+            name_format = 'create_tables_level_{}'
+
+        migrations = []
+        for i, batch in enumerate(batches, 1):
+            definition = [migration.definition[:2] for migration in batch]
+            migrations.append(Migration(
+                table='{} ({} tables)'.format(name_format.format(i), len(batch)),
+                name=name_format.format(i),
+                fingerprint=fingerprint(definition),
+                renderer=render_batch,
+                definition=(definition,)
+            ))
+
+        # The migration adding the foreign keys of circular references
+        return migrations + [migration for migration in planned if migration.renderer is not render_table]
+
+
+def plan_squashed(tables, metrics=None):
+    """Plan a single migration creating every table, as catalog_tables returns them
+
+    Loading one file is much faster than one per table when a test suite
+    migrates a fresh database over and over. The foreign keys are added once
+    every table exists, so circular references need no deferring.
+    """
+    if metrics is None:
+        metrics = ExportMetrics()
+
+    with metrics.phase('ordering'):
+        table_tree = create_tree(tables, True)[0]
+
+    with metrics.phase('planning'):
+        ordered_tables = [tables[name] for level in table_tree for name in level if name in tables]
+        return [Migration(
+            table=squashedMigrationName,
+            name=squashedMigrationName,
+            fingerprint=fingerprint(ordered_tables),
+            renderer=render_squashed,
+            definition=(ordered_tables,)
+        )]
+
+
+def render_migration(migration):
+    return ''.join(migration.renderer(*migration.definition))
+
+
+def render_timed(migration):
+    start = time.perf_counter()
+    text = render_migration(migration)
+    return text, time.perf_counter() - start
+
+
+def render_deferred_foreign_keys(deferred_keys):
+    return render_foreign_key_changes({}, deferred_keys)
+
+
+def render_foreign_key_changes(dropped_keys, added_keys):
+    """Render the migration dropping and adding foreign keys, both given as lists per table name"""
+    migration = [migrationHeaderTemplate]
+    migration.extend(render_foreign_key_tables(dropped_keys, added_keys))
+    migration.append('    }\n')
+
+    migration.append(migrationDownTemplate)
+    migration.extend(render_foreign_key_tables(added_keys, dropped_keys))
+    migration.append('    }\n};\n')
+
+    return migration
+
+
+def render_foreign_key_tables(dropped_keys, added_keys):
+    """Render a Schema::table call per table dropping its dropped_keys, then one per table adding its added_keys"""
+    migration = []
+
+    for table_name in sorted(dropped_keys, reverse=True):
+        if migration:
+            migration.append('\n')
+        migration.append(schemaTableTemplate.format(tableName=table_name))
+        for key in dropped_keys[table_name]:
+            migration.append(dropForeignKeyTemplate.format(foreignKey=key.columns[0]))
+        migration.append("{}}});\n".format(" " * 8))
+
+    for table_name in sorted(added_keys):
+        if migration:
+            migration.append('\n')
+        migration.append(schemaTableTemplate.format(tableName=table_name))
+        for key in added_keys[table_name]:
+            migration.append(foreign_key_template(key))
+        migration.append("{}}});\n".format(" " * 8))
+
+    return migration
+
+
+def render_squashed(tbls):
+    """Render the migration creating tbls in order, then adding their foreign keys grouped per table"""
+    migration = [migrationHeaderTemplate]
+
+    for i, tbl in enumerate(tbls):
+        if i > 0:
+            migration.append('\n')
+        migration.append(createTableTemplate.format(tableName=tbl.name))
+        migration.extend(render_create(tbl, None))
+
+    for tbl in tbls:
+        foreign_keys = migration_foreign_keys(tbl)
+        if foreign_keys:
+            migration.append('\n')
+            migration.append(schemaTableTemplate.format(tableName=tbl.name))
+            for key in foreign_keys:
+                migration.append(foreign_key_template(key))
+            migration.append("{}}});\n".format(" " * 8))
+
+    migration.append('    }\n')
+    migration.append(migrationDownTemplate)
+
+    migration.append(disableForeignKeysTemplate)
+    for tbl in reversed(tbls):
+        migration.append(dropTableTemplate.format(tableName=tbl.name))
+    migration.append(enableForeignKeysTemplate)
+
+    migration.append('    }\n};\n')
+
+    return migration
+
+
+def render_batch(definition):
+    """Render the migration creating a batch of (table, foreign keys) in order, with the keys inline"""
+    migration = [migrationHeaderTemplate]
+
+    for i, (tbl, foreign_keys) in enumerate(definition):
+        if i > 0:
+            migration.append('\n')
+        migration.append(createTableTemplate.format(tableName=tbl.name))
+        migration.extend(render_create(tbl, foreign_keys, inline=True))
+
+    migration.append('    }\n')
+    migration.append(migrationDownTemplate)
+
+    for tbl, foreign_keys in reversed(definition):
+        migration.append(dropTableTemplate.format(tableName=tbl.name))
+
+    migration.append('    }\n};\n')
+
+    return migration
+
+
+def fingerprint(*definition):
+    # The snapshot dataclasses repr every field in a fixed order, which makes
+    # their repr a normalized form of the definition
+    return hashlib.sha1(repr((pluginVersion,) + definition).encode('utf-8')).hexdigest()
+
+
+def render_create(tbl, foreign_keys, inline=False):
+    """Render the body of the Schema::create call of a table, adding foreign_keys after it
+
+    With foreign_keys None, the foreign keys of the table are left out
+    altogether, and with inline they are added in the Schema::create call.
+    """
+    table_name = tbl.name
+    table_engine = tbl.engine
+
+    migration = []
+
+    if table_engine != 'InnoDB':
+        migration.append("{}$table->engine = '{}';\n".format(" " * 12, table_engine))
+    if tbl.charset:
+        migration.append("{}$table->charset = '{}';\n".format(" " * 12, tbl.charset))
+    if tbl.collation:
+        migration.append("{}$table->collation = '{}';\n".format(" " * 12, tbl.collation))
+
+    created_at = created_at_nullable \
+        = updated_at \
+        = updated_at_nullable \
+        = deleted_at \
+        = timestamps \
+        = timestamps_nullable = False
+
+    for col in tbl.columns:
+        if col.name == 'created_at':
+            created_at = True
+            if col.is_not_null != 1:
+                created_at_nullable = True
+        elif col.name == 'updated_at':
+            updated_at = True
+            if col.is_not_null != 1:
+                updated_at_nullable = True
+
+    if created_at is True and updated_at is True and created_at_nullable is True:
+        if updated_at_nullable is True:
+            timestamps_nullable = True
+        elif created_at is True and updated_at is True:
+            timestamps = True
+    elif created_at is True and updated_at is True:
+        timestamps = True
+
+    primary_col = tbl.primary_column
+
+    # Generate indexes
+    indexes = {"primary": {}, "unique": {}, "index": {}, "fulltext": {}}
+    for index in tbl.indices:
+        index_type = index.index_type.lower()
+        if index_type == "primary":
+            continue
+
+        index_name = index.name
+        indexes[index_type][index_name] = list(index.columns)
+
+    # Per-column lookups for the column loop: foreign key columns
+    # and the single-column indexes each column gets inline
+    foreign_key_columns = set(
+        key.columns[0] for key in tbl.foreign_keys if key.name != '' and key.index_name is not None
+    )
+    column_indexes = {}
+    for index_type in ('unique', 'index'):
+        for index_name in indexes[index_type]:
+            if len(indexes[index_type][index_name]) == 1:
+                column_name = indexes[index_type][index_name][0]
+                if column_name not in column_indexes:
+                    column_indexes[column_name] = []
+                column_indexes[column_name].append(index_type)
+
+    for col in tbl.columns:
+        if (col.name == 'created_at' or col.name == 'updated_at') and (
+                timestamps is True or timestamps_nullable is True):
+            continue
+
+        if col.name == 'deleted_at':
+            deleted_at = True
+            continue
+
+        column = render_column(col, primary_col, column_indexes.get(col.name, ()), col.name in foreign_key_columns)
+        if column is not None:
+            migration.extend(column)
+            migration.append(';\n')
+
+    if timestamps is True or timestamps_nullable is True:
+        migration.append('{}$table->timestamps();\n'.format(" " * 12))
+    if deleted_at is True:
+        migration.append('{}$table->softDeletes();\n'.format(" " * 12))
+
+    # Append indexes
+    for index_type in indexes:
+        for index_name in indexes[index_type]:
+            if len(indexes[index_type][index_name]) > 1:
+                index_key_template = indexKeyTemplate.format(
+                    indexType=index_type,
+                    indexColumns=", ".join(
+                        ["'{}'".format(column_name) for column_name in indexes[index_type][index_name]]),
                 )
+                migration.append(index_key_template)
+
+    if foreign_keys is not None:
+        if len(tbl.foreign_keys) and not inline:
+            migration.append(foreignKeySectionTemplate.format(tableName=table_name))
+
+        for key in foreign_keys:
+            migration.append(foreign_key_template(key))
+
+    migration.append("{}}});\n".format(" " * 8))
+
+    # Blueprint has no properties for the rest of the storage options; the
+    # table is still empty, so altering it right away costs nothing
+    options = table_options(tbl)
+    if options:
+        migration.append(tableStatementTemplate.format(tableName=table_name, options=addslashes(' '.join(options))))
+
+    return migration
+
+
+def table_options(tbl):
+    """The storage options of a table Blueprint has no properties for, as ALTER TABLE clauses"""
+    options = []
+    if tbl.row_format and tbl.row_format != 'DEFAULT':
+        options.append('ROW_FORMAT={}'.format(tbl.row_format))
+    if tbl.key_block_size and tbl.key_block_size != '0':
+        options.append('KEY_BLOCK_SIZE={}'.format(tbl.key_block_size))
+    if tbl.auto_increment and tbl.auto_increment != '0':
+        options.append('AUTO_INCREMENT={}'.format(tbl.auto_increment))
+    if tbl.partitioning is not None:
+        options.append(partition_clause(tbl.partitioning))
+
+    return options
+
+
+def altered_table_options(previous, tbl):
+    """The ALTER TABLE clauses turning the storage options of the previous definition of a table into tbl's"""
+    options = []
+    if tbl.engine != previous.engine:
+        options.append('ENGINE={}'.format(tbl.engine or 'InnoDB'))
+    if tbl.charset and tbl.charset != previous.charset:
+        options.append('DEFAULT CHARACTER SET {}'.format(tbl.charset))
+    if tbl.collation and tbl.collation != previous.collation:
+        options.append('COLLATE {}'.format(tbl.collation))
+    if tbl.row_format != previous.row_format:
+        options.append('ROW_FORMAT={}'.format(tbl.row_format or 'DEFAULT'))
+    if tbl.key_block_size != previous.key_block_size:
+        options.append('KEY_BLOCK_SIZE={}'.format(tbl.key_block_size or 0))
+    if tbl.auto_increment and tbl.auto_increment != previous.auto_increment:
+        options.append('AUTO_INCREMENT={}'.format(tbl.auto_increment))
+    if tbl.partitioning != previous.partitioning:
+        options.append(partition_clause(tbl.partitioning) if tbl.partitioning is not None else 'REMOVE PARTITIONING')
+
+    return options
+
+
+def partition_clause(partitioning):
+    clause = ['PARTITION BY {}({})'.format(partitioning.partition_type, partitioning.expression)]
+    if partitioning.count and not partitioning.definitions:
+        clause.append('PARTITIONS {}'.format(partitioning.count))
+
+    if partitioning.subpartition_type:
+        clause.append('SUBPARTITION BY {}({})'.format(partitioning.subpartition_type,
+                                                      partitioning.subpartition_expression))
+        if partitioning.subpartition_count:
+            clause.append('SUBPARTITIONS {}'.format(partitioning.subpartition_count))
+
+    if partitioning.definitions:
+        partition_type = partitioning.partition_type.upper()
+        definitions = []
+        for definition in partitioning.definitions:
+            if partition_type.startswith('RANGE'):
+                definitions.append('PARTITION {} VALUES LESS THAN ({})'.format(definition.name, definition.value))
+            elif partition_type.startswith('LIST'):
+                definitions.append('PARTITION {} VALUES IN ({})'.format(definition.name, definition.value))
+            else:
+                definitions.append('PARTITION {}'.format(definition.name))
+        clause.append('({})'.format(', '.join(definitions)))
+
+    return ' '.join(clause)
+
+
+def char_arguments(col):
+    return ', {}'.format(col.length) if col.length > -1 else ''
+
+
+def decimal_arguments(col):
+    return ', {}, {}'.format(col.precision, col.scale) if col.precision > -1 and col.scale > -1 else ''
+
+
+def double_arguments(col):
+    return ', {}, {}'.format(col.length, col.precision) if col.precision > -1 and col.length > -1 else ''
+
+
+def enum_arguments(col):
+    return ', [{}]'.format(col.explicit_params[1:-1])
+
+
+def string_arguments(col):
+    return ', {}'.format(col.length) if col.length > -1 and col.length != 255 else ''
+
+
+def no_arguments(col):
+    return ''
+
+
+def boolean_default(default_value, type_group):
+    return '->default({})'.format('true' if default_value == '1' else 'false')
+
+
+def value_default(default_value, type_group):
+    if type_group == 'numeric':
+        return '->default({})'.format(default_value)
+
+    return "->default('{}')".format(default_value)
+
+
+columnArguments = {
+    'char': char_arguments,
+    'decimal': decimal_arguments,
+    'double': double_arguments,
+    'enum': enum_arguments,
+    'string': string_arguments,
+}
+
+# Blueprint method, argument renderer and default value renderer of every
+# type in typesDict; types without a Blueprint method are left out
+columnRenderers = dict(
+    (col_type, (method, columnArguments.get(method, no_arguments),
+                boolean_default if method == 'boolean' else value_default))
+    for col_type, method in typesDict.items() if method
+)
+
+
+def render_column(col, primary_col, index_types=(), foreign_key_column=False):
+    """Render the Blueprint call of a column, or None for columns Laravel has no type for
+
+    index_types are the single-column index types ('unique', 'index') of the
+    column, which are chained to the call unless it is a foreign key column.
+    """
+    col_type = col.type_name
+    if col_type is None:
+        return None
+
+    if col_type == "TINYINT" and col.precision == 1:
+        col_type = "BOOLEAN"
+
+    if col.name == primary_col:
+        if col_type == "CHAR" and col.length == 36:
+            col_type = "UUID"
+        else:
+            col_type = primaryColumnTypes.get(col_type, "INCREMENTS")
+
+    if col_type in unsignedColumnTypes and 'UNSIGNED' in col.flags:
+        col_type = "u" + col_type
+
+    # Skip the column if Laravel has no type for it
+    renderer = columnRenderers.get(col_type)
+    if renderer is None:
+        return None
+
+    method, arguments, default = renderer
+
+    if col.name == 'remember_token' and method == 'string' and col.length == 100:
+        return ['{}$table->rememberToken()'.format(" " * 12)]
+    elif col.name == 'id' and method == 'bigIncrements':
+        return ['{}$table->id()'.format(" " * 12)]
+
+    column = ["{}$table->{}('{}'{})".format(" " * 12, method, col.name, arguments(col))]
+
+    if method == 'integer' and 'UNSIGNED' in col.flags:
+        column.append('->unsigned()')
+
+    if col.is_not_null != 1 and col.name != primary_col:
+        column.append('->nullable()')
+
+    if col.default_value != '' and col.default_value_is_null == 0:
+        default_value = col.default_value.replace("'", "")
+
+        if default_value in defaultTimeValues:
+            column.append("->default(DB::raw('{}'))".format(default_value))
+        else:
+            column.append(default(default_value, col.type_group))
+
+    if col.comment != '':
+        column.append("->comment('{}')".format(addslashes(col.comment)))
+
+    if col.name == primary_col and (method == 'string' or method == 'uuid'):
+        column.append('->primary()')
+
+    for index_type in index_types:
+        if index_type == 'unique':
+            column.append('->unique()')
+        elif not foreign_key_column:
+            column.append('->index()')
+
+    return column
+
+
+def migration_indexes(tbl):
+    """The indexes of a table migrations create, by name
+
+    Primary keys come with their column, and single-column indexes on foreign
+    key columns with the foreign key.
+    """
+    foreign_key_columns = set(key.columns[0] for key in migration_foreign_keys(tbl))
+    return OrderedDict(
+        (index.name, index) for index in tbl.indices
+        if index.index_type.lower() != 'primary'
+        and not (index.index_type.lower() == 'index' and len(index.columns) == 1
+                 and index.columns[0] in foreign_key_columns)
+    )
+
+
+def migration_foreign_keys(tbl):
+    return [key for key in tbl.foreign_keys if key.name != '' and key.index_name is not None]
+
+
+def changed_foreign_keys(previous, tbl):
+    """The foreign keys of the previous definition of a table that tbl does not have"""
+    keys = dict((key.columns[0], key) for key in migration_foreign_keys(tbl))
+    return [key for key in migration_foreign_keys(previous) if keys.get(key.columns[0]) != key]
+
+
+def render_alterations(previous, tbl):
+    """Render the Blueprint calls altering the previous definition of a table into tbl
 
-        return r
+    Leaves out the foreign keys, which plan_diff changes around every other
+    alteration.
+    """
+    alterations = []
 
-    def addslashes(s):
-        replaces = ["\\", "'", "\0", ]
-        for i in replaces:
-            if i in s:
-                s = s.replace(i, '\\' + i)
-        return s
+    previous_indexes = migration_indexes(previous)
+    indexes = migration_indexes(tbl)
+    previous_columns = OrderedDict((col.name, col) for col in previous.columns)
 
-    def export_schema(table_schema, tree):
-        if len(table_schema.tables) == 0:
+    for name, index in previous_indexes.items():
+        if indexes.get(name) != index:
+            alterations.append(dropIndexTemplate.format(
+                dropMethod=dropIndexMethods[index.index_type.lower()],
+                indexColumns=", ".join(["'{}'".format(column_name) for column_name in index.columns])
+            ))
+
+    column_names = set(col.name for col in tbl.columns)
+    for name in previous_columns:
+        if name not in column_names:
+            alterations.append(dropColumnTemplate.format(columnName=name))
+
+    for col in tbl.columns:
+        column = render_column(col, tbl.primary_column)
+        if column is None:
+            continue
+
+        if col.name in previous_columns:
+            if column == render_column(previous_columns[col.name], previous.primary_column):
+                continue
+            column.append('->change()')
+
+        alterations.extend(column)
+        alterations.append(';\n')
+
+    for name, index in indexes.items():
+        if previous_indexes.get(name) != index:
+            alterations.append(indexKeyTemplate.format(
+                indexType=index.index_type.lower(),
+                indexColumns=", ".join(["'{}'".format(column_name) for column_name in index.columns])
+            ))
+
+    return alterations
+
+
+def render_table_update(previous, tbl):
+    """Render the update migration altering the previous definition of a table into tbl"""
+    migration = [migrationHeaderTemplate]
+    migration.extend(render_table_alteration(previous, tbl))
+    migration.append('    }\n')
+
+    migration.append(migrationDownTemplate)
+    migration.extend(render_table_alteration(tbl, previous))
+    migration.append('    }\n};\n')
+
+    return migration
+
+
+def render_table_alteration(previous, tbl):
+    """Render the Schema::table call and storage option statement altering previous into tbl"""
+    alterations = render_alterations(previous, tbl)
+    options = altered_table_options(previous, tbl)
+    migration = []
+
+    if alterations or not options:
+        migration.append(schemaTableTemplate.format(tableName=tbl.name))
+        migration.extend(alterations)
+        migration.append("{}}});\n".format(" " * 8))
+
+    if options:
+        statement = tableStatementTemplate.format(tableName=tbl.name, options=addslashes(' '.join(options)))
+        migration.append(statement if alterations else statement.lstrip('\n'))
+
+    return migration
+
+
+def render_table_drop(tbl):
+    """Render the drop migration of a table, which re-creates it on rollback"""
+    foreign_keys = migration_foreign_keys(tbl)
+    migration = [migrationHeaderTemplate]
+
+    if foreign_keys:
+        migration.append(schemaTableTemplate.format(tableName=tbl.name))
+        for key in foreign_keys:
+            migration.append(dropForeignKeyTemplate.format(foreignKey=key.columns[0]))
+        migration.append("{}}});\n\n".format(" " * 8))
+
+    migration.append(dropTableTemplate.format(tableName=tbl.name))
+    migration.append('    }\n')
+
+    migration.append(migrationDownTemplate)
+    migration.append(createTableTemplate.format(tableName=tbl.name))
+    migration.extend(render_create(tbl, foreign_keys))
+
+    migration.append('    }\n};\n')
+
+    return migration
+
+
+def render_table(tbl, foreign_keys, pending_foreign_keys):
+    """Render the create migration of a table
+
+    foreign_keys are the keys of tbl to add along with it, pending_foreign_keys
+    the keys of tables created earlier that could only be added once tbl exists.
+    """
+    table_name = tbl.name
+    components = table_name.split('_')
+
+    migration = []
+
+    migration.append(migrationTemplate.format(
+        tableNameCamelCase=("".join(x.title() for x in components[0:])),
+        tableName=table_name
+    ))
+
+    migration.extend(render_create(tbl, foreign_keys))
+
+    if pending_foreign_keys:
+        keyed_tables = []
+        schema_table = 0
+        for item in pending_foreign_keys:
+            if item['table'] not in keyed_tables:
+                keyed_tables.append(item['table'])
+                foreign_table_name = item['table']
+
+                if schema_table == 0:
+                    migration.append('\n')
+                    migration.append(
+                        schemaCreateTemplate.format(tableName=item['table'])
+                    )
+                    schema_table = 1
+                elif foreign_table_name != item['table']:
+                    migration.append("{}});\n".format(" " * 12))
+                    migration.append('\n')
+                    migration.append(
+                        schemaCreateTemplate.format(tableName=item['table'])
+                    )
+                migration.append(foreignKeyTemplate.format(
+                    foreignKey=item['key'],
+                    tableKeyName=item['referenced_name'],
+                    foreignTableName=item['referenced_table'],
+                    onDeleteAction=item['delete_rule'].lower(),
+                    onUpdateAction=item['update_rule'].lower()
+                ))
+
+        if schema_table == 1:
+            migration.append("{}}});\n".format(" " * 12))
+
+    migration.append('    }\n')
+
+    ##########
+    # Reverse
+    ##########
+
+    migration.append(migrationDownTemplate)
+    migration.append(migrationEndingTemplate.format(tableName=table_name))
+
+    return migration
+
+
+def advise_table(tbl):
+    """Find the indexing hazards of a table, returning them as Advice
+
+    - unindexed_foreign_key: a foreign key the migrations do not add, so
+      MySQL creates no index for it either, and no index starts with its columns
+    - suppressed_index: an index on a foreign key column the migrations leave
+      to MySQL, which names it after the constraint instead
+    - redundant_index: an index starting another index, which serves its queries
+    - key_too_long: an index on string columns longer than InnoDB allows in utf8mb4
+    - partitioned_foreign_keys: foreign keys on a partitioned table, which InnoDB rejects
+    """
+    advice = []
+    indices = [index for index in tbl.indices if index.index_type.lower() != 'fulltext']
+
+    for key in unindexed_foreign_keys(tbl):
+        advice.append(Advice(tbl.name, 'unindexed_foreign_key', 'Foreign key {} on {} is not migrated and no index '
+                             'starts with its columns'.format(key.name or '(unnamed)', ', '.join(key.columns))))
+
+    foreign_key_columns = dict((key.columns[0], key) for key in migration_foreign_keys(tbl))
+    for index in indices:
+        if index.index_type.lower() == 'index' and len(index.columns) == 1 and \
+                index.columns[0] in foreign_key_columns:
+            advice.append(Advice(tbl.name, 'suppressed_index', 'Index {} is left to foreign key {}, which MySQL names '
+                                 'its index after'.format(index.name, foreign_key_columns[index.columns[0]].name)))
+
+    for i, index in enumerate(indices):
+        if index.index_type.lower() != 'index':
+            continue
+
+        for j, other in enumerate(indices):
+            if i != j and other.columns[:len(index.columns)] == index.columns and (
+                    len(other.columns) > len(index.columns) or other.index_type.lower() != 'index' or j < i):
+                advice.append(Advice(tbl.name, 'redundant_index', 'Index {} is redundant with index {}, which starts '
+                                     'with the same columns'.format(index.name, other.name)))
+                break
+
+    columns = dict((col.name, col) for col in tbl.columns)
+    for index in indices:
+        key_bytes = 0
+        for column_name in index.columns:
+            col = columns.get(column_name)
+            if col is not None and col.type_name in ('VARCHAR', 'CHAR'):
+                key_bytes += (col.length if col.length > -1 else defaultStringLength) * utf8mb4CharBytes
+
+        if key_bytes > indexKeyMaxBytes:
+            advice.append(Advice(tbl.name, 'key_too_long', 'Index {} takes up to {} bytes in utf8mb4, more than the {} '
+                                 'InnoDB allows'.format(index.name, key_bytes, indexKeyMaxBytes)))
+
+    if tbl.partitioning is not None and migration_foreign_keys(tbl):
+        advice.append(Advice(tbl.name, 'partitioned_foreign_keys', 'Table is partitioned, which InnoDB does not '
+                             'support along with foreign keys'))
+
+    return advice
+
+
+def unindexed_foreign_keys(tbl):
+    """The foreign keys of a table which the migrations neither add nor index"""
+    foreign_keys = migration_foreign_keys(tbl)
+    return [
+        key for key in tbl.foreign_keys
+        if key not in foreign_keys and key.columns and not any(
+            index.columns[:len(key.columns)] == key.columns
+            for index in tbl.indices if index.index_type.lower() != 'fulltext'
+        )
+    ]
+
+
+def advise_tables(tables):
+    """Run the advisor on tables, as catalog_tables returns them, by table name"""
+    advice = OrderedDict()
+    for name in sorted(tables):
+        table_advice = advise_table(tables[name])
+        if table_advice:
+            advice[name] = table_advice
+
+    return advice
+
+
+def add_missing_indexes(tables):
+    """Copy tables, adding an index to each foreign key the advisor finds unindexed"""
+    patched = {}
+    for name, tbl in tables.items():
+        indices = OrderedDict()
+        for key in unindexed_foreign_keys(tbl):
+            index_name = '{}_{}_index'.format(name, '_'.join(key.columns))
+            indices[index_name] = Index(name=index_name, index_type='INDEX', is_primary=0, columns=list(key.columns))
+
+        patched[name] = replace(tbl, indices=tbl.indices + list(indices.values())) if indices else tbl
+
+    return patched
+
+
+def plan_migrations(tables, defer_cycles=False, metrics=None):
+    """Plan the migrations of tables, as catalog_tables returns them"""
+    if metrics is None:
+        metrics = ExportMetrics()
+
+    with metrics.phase('ordering'):
+        table_tree, deferred_references = create_tree(tables, defer_cycles)
+
+    with metrics.phase('planning'):
+        return plan_tables(tables, table_tree, deferred_references)
+
+
+def generate_migrations(migrations, jobs=1, unchanged=None, cache=None, metrics=None):
+    """Render planned migrations one at a time, yielding (migration, text) pairs
+
+    unchanged maps migration names to the fingerprints of migrations saved
+    earlier; those still matching are not rendered and come with None.
+    Migrations found in cache (a RenderCache) are not rendered either.
+    """
+    unchanged = unchanged or {}
+    if metrics is None:
+        metrics = ExportMetrics()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+
+    try:
+        # Only render a window ahead, so the rendered text held in memory
+        # does not grow with the size of the catalog
+        window_size = max(1, jobs) * renderAheadSize
+        for start in range(0, len(migrations), window_size):
+            window = migrations[start:start + window_size]
+            texts = {}
+            misses = []
+            for migration in window:
+                if unchanged.get(migration.name) == migration.fingerprint:
+                    continue
+
+                text = cache.get(migration.fingerprint) if cache is not None else None
+                if text is None:
+                    misses.append(migration)
+                else:
+                    texts[migration.name] = text
+                    metrics.count('cache_hits')
+
+            if executor is None:
+                rendered = map(render_timed, misses)
+            else:
+                rendered = executor.map(render_timed, misses, chunksize=max(1, len(misses) // (jobs * 4)))
+
+            for migration, (text, seconds) in zip(misses, rendered):
+                texts[migration.name] = text
+                metrics.table(migration.table, seconds)
+                if cache is not None:
+                    cache.put(migration.fingerprint, text)
+
+            for migration in window:
+                yield migration, texts.get(migration.name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+class RenderCache(object):
+    """Rendered migrations kept in an SQLite database between runs
+
+    Entries are keyed by the migration fingerprint, which covers the plugin
+    version and the definition of the migration, the only input of rendering.
+    Entries of other plugin versions are dropped on open, and the least
+    recently used ones once the cache grows past max_size megabytes. Should
+    the database fail later on, e.g. locked or on a full disk, the export goes
+    on rendering without it.
+    """
+
+    def __init__(self, path, max_size=renderCacheSize):
+        self.path = path
+        self.max_size = max_size * 1024 * 1024
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS migrations (fingerprint TEXT PRIMARY KEY, version TEXT, text TEXT, '
+            'size INTEGER, used REAL)'
+        )
+        self.connection.execute('DELETE FROM migrations WHERE version != ?', (pluginVersion,))
+
+    def get(self, fingerprint):
+        if self.connection is None:
+            return None
+
+        try:
+            row = self.connection.execute(
+                'SELECT text FROM migrations WHERE fingerprint = ?', (fingerprint,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self.connection.execute(
+                'UPDATE migrations SET used = ? WHERE fingerprint = ?', (time.time(), fingerprint)
+            )
+        except sqlite3.Error as e:
+            self.fail(e)
+            return None
+
+        return row[0]
+
+    def put(self, fingerprint, text):
+        if self.connection is None:
             return
 
-        foreign_keys = {}
-        global migration_tables
-        global migrations
-
-        tables = sorted(table_schema.tables, key=lambda table: table.name)
-        ti = 0
-        migrations = {}
-        migration_tables = []
-
-        for reference_tables in tree:
-            for reference in reference_tables:
-                for tbl in tables:
-
-                    if tbl.name != reference:
-                        continue
-
-                    table_name = tbl.name
-                    table_engine = tbl.tableEngine
-                    components = table_name.split('_')
-
-                    migration_tables.append(table_name)
-                    migrations[ti] = []
-
-                    migrations[ti].append(migrationTemplate.format(
-                        tableNameCamelCase=("".join(x.title() for x in components[0:])),
-                        tableName=table_name
-                    ))
-
-                    if table_engine != 'InnoDB':
-                        migrations[ti].append("{}$table->engine = '{}';\n".format(" " * 12, table_engine))
-
-                    created_at = created_at_nullable \
-                        = updated_at \
-                        = updated_at_nullable \
-                        = deleted_at \
-                        = timestamps \
-                        = timestamps_nullable = False
-
-                    for col in tbl.columns:
-                        if col.name == 'created_at':
-                            created_at = True
-                            if col.isNotNull != 1:
-                                created_at_nullable = True
-                        elif col.name == 'updated_at':
-                            updated_at = True
-                            if col.isNotNull != 1:
-                                updated_at_nullable = True
-
-                    if created_at is True and updated_at is True and created_at_nullable is True:
-                        if updated_at_nullable is True:
-                            timestamps_nullable = True
-                        elif created_at is True and updated_at is True:
-                            timestamps = True
-                    elif created_at is True and updated_at is True:
-                        timestamps = True
-
-                    primary_key = [col for col in tbl.indices if col.isPrimary == 1]
-                    primary_key = primary_key[0] if len(primary_key) > 0 else None
-
-                    if hasattr(primary_key, 'columns'):
-                        primary_col = primary_key.columns[0].referencedColumn
-                    else:
-                        primary_col = None
-
-                    # Generate indexes
-                    indexes = {"primary": {}, "unique": {}, "index": {}, "fulltext": {}}
-                    for index in tbl.indices:
-                        index_type = index.indexType.lower()
-                        if index_type == "primary":
-                            continue
-
-                        index_name = index.name
-                        indexes[index_type][index_name] = []
-
-                        for column in index.columns:
-                            indexes[index_type][index_name].append(column.referencedColumn.name)
-
-                    default_time_values = [
-                        'CURRENT_TIMESTAMP',
-                        'NULL ON UPDATE CURRENT_TIMESTAMP',
-                        'CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'
-                    ]
-
-                    for col in tbl.columns:
-                        # Name is important attribute so it has to be set
-                        # in order to make this work
-                        # https://github.com/beckenrode/mysql-workbench-export-laravel-5-migrations/issues/18#issuecomment-272152778
-                        try:
-
-                            if (col.name == 'created_at' or col.name == 'updated_at') and (
-                                    timestamps is True or timestamps_nullable is True):
-                                continue
-
-                            if col.name == 'deleted_at':
-                                deleted_at = True
-                                continue
-
-                            col_has_foreign_key = False
-                            for key in tbl.foreignKeys:
-                                if key.name != '' and hasattr(key.index, 'name') and key.columns[0].name == col.name:
-                                    col_has_foreign_key = True
-
-                            if col.simpleType:
-                                col_type = col.simpleType.name
-                                col_type_group = col.simpleType.group.name
-                            else:
-                                col_type = col.userType.name
-                                col_type_group = col.userType.group.name
-
-                            if col_type == "TINYINT" and col.precision == 1:
-                                col_type = "BOOLEAN"
-
-                            if col == primary_col:
-                                if col_type == "BIGINT":
-                                    col_type = "BIG_INCREMENTS"
-                                elif col_type == "MEDIUMINT":
-                                    col_type = "MEDIUM_INCREMENTS"
-                                elif col_type == "VARCHAR":
-                                    col_type = "VARCHAR"
-                                elif col_type == "CHAR" and col.length == 36:
-                                    col_type = "UUID"
-                                elif col_type == "CHAR":
-                                    pass
-                                else:
-                                    col_type = "INCREMENTS"
-
-                            if (col_type == 'BIGINT'
-                                or col_type == 'INT'
-                                or col_type == 'TINYINT'
-                                or col_type == 'MEDIUMINT'
-                                or col_type == 'SMALLINT') \
-                                    and 'UNSIGNED' in col.flags:
-                                col_type = "u" + col_type
-
-                            col_data = '\''
-
-                            # Continue if type is not in dictionary
-                            if col_type not in typesDict:
-                                continue
-
-                            if typesDict[col_type] == 'char':
-                                if col.length > -1:
-                                    col_data = '\', %s' % (str(col.length))
-                            elif typesDict[col_type] == 'decimal':
-                                if col.precision > -1 and col.scale > -1:
-                                    col_data = '\', %s, %s' % (str(col.precision), str(col.scale))
-                            elif typesDict[col_type] == 'double':
-                                if col.precision > -1 and col.length > -1:
-                                    col_data = '\', %s, %s' % (str(col.length), str(col.precision))
-                            elif typesDict[col_type] == 'enum':
-                                col_data = '\', [%s]' % (col.datatypeExplicitParams[1:-1])
-                            elif typesDict[col_type] == 'string':
-                                if col.length > -1 and col.length != 255:
-                                    col_data = '\', %s' % (str(col.length))
-                                else:
-                                    col_data = '\''
-
-                            if col.name == 'remember_token'\
-                                    and typesDict[col_type] == 'string'\
-                                    and str(col.length) == '100':
-                                migrations[ti].append('{}$table->rememberToken();\n'.format(
-                                    " " * 12
-                                ))
-                            elif col.name == 'id'\
-                                    and typesDict[col_type] == 'bigIncrements':
-                                migrations[ti].append('{}$table->id();\n'.format(
-                                    " " * 12
-                                ))
-                            elif typesDict[col_type]:
-                                migrations[ti].append("{}$table->{}('{}{})".format(
-                                    " " * 12,
-                                    typesDict[col_type],
-                                    col.name,
-                                    col_data
-                                ))
-
-                                if typesDict[col_type] == 'integer' and 'UNSIGNED' in col.flags:
-                                    migrations[ti].append('->unsigned()')
-
-                                if col.isNotNull != 1 and col != primary_col:
-                                    migrations[ti].append('->nullable()')
-
-                                if col.defaultValue != '' and col.defaultValueIsNull != 0:
-                                    pass
-                                elif col.defaultValue != '':
-                                    default_value = col.defaultValue.replace("'", "")
-
-                                    if default_value in default_time_values:
-                                        migrations[ti].append("->default(DB::raw('{}'))".format(default_value))
-                                    elif typesDict[col_type] == 'boolean':
-                                        default_value = 'true' if default_value == '1' else 'false'
-                                        migrations[ti].append("->default({})".format(default_value))
-                                    elif col_type_group == 'numeric':
-                                        migrations[ti].append("->default({})".format(default_value))
-                                    else:
-                                        migrations[ti].append("->default('{}')".format(default_value))
-
-                                if col.comment != '':
-                                    migrations[ti].append("->comment('{}')".format(addslashes(col.comment)))
-
-                                if col == primary_col and (typesDict[col_type] == 'string' or typesDict[col_type] == 'uuid'):
-                                    migrations[ti].append('->primary()')
-
-                                for index_name in indexes['unique']:
-                                    if len(indexes['unique'][index_name]) == 1 and indexes['unique'][index_name][0] == col.name:
-                                        migrations[ti].append('->unique()')
-
-                                for index_name in indexes['index']:
-                                    if len(indexes['index'][index_name]) == 1 and indexes['index'][index_name][0] == col.name and not col_has_foreign_key:
-                                        migrations[ti].append('->index()')
-
-                                migrations[ti].append(';\n')
-                        except AttributeError:
-                            pass
-
-                    if timestamps is True or timestamps_nullable is True:
-                        migrations[ti].append('{}$table->timestamps();\n'.format(" " * 12))
-                    if deleted_at is True:
-                        migrations[ti].append('{}$table->softDeletes();\n'.format(" " * 12))
-
-                    # Append indexes
-                    for index_type in indexes:
-                        for index_name in indexes[index_type]:
-                            if len(indexes[index_type][index_name]) > 1:
-                                index_key_template = indexKeyTemplate.format(
-                                    indexType=index_type,
-                                    indexColumns=", ".join(
-                                        ["'{}'".format(column_name) for column_name in indexes[index_type][index_name]]),
-                                )
-                                migrations[ti].append(index_key_template)
-
-                    if len(tbl.foreignKeys):
-                        migrations[ti].append(foreignKeySectionTemplate.format(tableName=table_name));
-                    
-                    for key in tbl.foreignKeys:
-                        if key.name != '' and hasattr(key.index, 'name'):
-                            index_name = key.index.name
-                            foreign_key = key.columns[0].name
-
-                            if index_name == 'PRIMARY':
-                                index_name = tbl.name + "_" + key.columns[0].name
-
-                            if key.referencedColumns[0].owner.name in migration_tables:
-                                delete_rule = key.deleteRule
-                                if delete_rule == "":
-                                    delete_rule = "RESTRICT"
-
-                                if delete_rule == 'CASCADE':
-                                    on_delete_method = '->cascadeOnDelete()'
-                                elif delete_rule == 'RESTRICT' or delete_rule == 'NO ACTION':
-                                    on_delete_method = '->restrictOnDelete()'
-                                elif delete_rule == 'SET NULL':
-                                    on_delete_method = '->nullOnDelete()'
-                                else:
-                                    on_delete_method = "->onDelete('{onDeleteAction}')".format(onDeleteAction=delete_rule.lower())
-
-                                update_rule = key.updateRule
-                                if update_rule == "":
-                                    update_rule = "RESTRICT"
-
-                                if update_rule == 'CASCADE':
-                                    on_update_method = '->cascadeOnUpdate()'
-                                elif update_rule == 'RESTRICT' or update_rule == 'NO ACTION':
-                                    on_update_method = '->restrictOnUpdate()'
-                                else:
-                                    on_update_method = "->onUpdate('{onUpdateAction}')".format(onUpdateAction=update_rule.lower())
-
-                                migrations[ti].append(foreignKeyTemplate.format(
-                                    foreignKey=foreign_key,
-                                    tableKeyName=key.referencedColumns[0].name,
-                                    foreignTableName=key.referencedColumns[0].owner.name,
-                                    onUpdateMethod=on_update_method,
-                                    onDeleteMethod=on_delete_method
-                                ))
-
-                            else:
-                                if key.referencedColumns[0].owner.name not in foreign_keys:
-                                    foreign_keys[key.referencedColumns[0].owner.name] = []
-
-                                foreign_keys[key.referencedColumns[0].owner.name].append({
-                                    'table': key.columns[0].owner.name,
-                                    'key': foreign_key,
-                                    'name': index_name,
-                                    'referenced_table': key.referencedColumns[0].owner.name,
-                                    'referenced_name': key.referencedColumns[0].name,
-                                    'update_rule': key.updateRule,
-                                    'delete_rule': key.deleteRule
-                                })
-
-                    migrations[ti].append("{}}});\n".format(" " * 8))
-
-                    for key, val in foreign_keys.items():
-                        if key == tbl.name:
-                            keyed_tables = []
-                            schema_table = 0
-                            for item in val:
-                                if item['table'] not in keyed_tables:
-                                    keyed_tables.append(item['table'])
-                                    foreign_table_name = item['table']
-
-                                    if schema_table == 0:
-                                        migrations[ti].append('\n')
-                                        migrations[ti].append(
-                                            schemaCreateTemplate.format(tableName=item['table'])
-                                        )
-                                        schema_table = 1
-                                    elif foreign_table_name != item['table']:
-                                        migrations[ti].append("{}});\n".format(" " * 12))
-                                        migrations[ti].append('\n')
-                                        migrations[ti].append(
-                                            schemaCreateTemplate.format(tableName=item['table'])
-                                        )
-                                    migrations[ti].append(foreignKeyTemplate.format(
-                                        foreignKey=item['key'],
-                                        tableKeyName=item['referenced_name'],
-                                        foreignTableName=item['referenced_table'],
-                                        onDeleteAction=item['delete_rule'].lower(),
-                                        onUpdateAction=item['update_rule'].lower()
-                                    ))
-
-                            if schema_table == 1:
-                                migrations[ti].append("{}}});\n".format(" " * 12))
-
-                    migrations[ti].append('    }\n')
-
-                    ##########
-                    # Reverse
-                    ##########
-
-                    migrations[ti].append(migrationDownTemplate)
-                    migrations[ti].append(migrationEndingTemplate.format(tableName=table_name))
-                    ti += 1
-
-        return migrations
-
-    out = StringIO()
+        try:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO migrations VALUES (?, ?, ?, ?, ?)',
+                (fingerprint, pluginVersion, text, len(text), time.time())
+            )
+        except sqlite3.Error as e:
+            self.fail(e)
+
+    def commit(self):
+        """Save the entries of this run, trimming the cache to max_size and releasing its lock on the file"""
+        if self.connection is None:
+            return
+
+        try:
+            size = 0
+            evicted = []
+            for rowid, entry_size in self.connection.execute('SELECT rowid, size FROM migrations ORDER BY used DESC'):
+                size += entry_size
+                if size > self.max_size:
+                    evicted.append((rowid,))
+
+            self.connection.executemany('DELETE FROM migrations WHERE rowid = ?', evicted)
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.fail(e)
+
+    def close(self):
+        self.commit()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def fail(self, e):
+        sys.stderr.write('Could not use cache "{}", rendering without it: {}\n'.format(self.path, str(e)))
+        try:
+            self.connection.close()
+        except sqlite3.Error:
+            pass
+        self.connection = None
+
+
+class ExportMetrics(object):
+    """Wall time per phase and per table, and counters of an export
+
+    The rendering phase adds up the time spent on each table, which exceeds
+    the wall time when rendering in parallel.
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.tables = {}
+        self.counters = OrderedDict((counter, 0) for counter in exportCounters)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def table(self, name, seconds):
+        self.tables[name] = self.tables.get(name, 0) + seconds
+        self.add_time('rendering', seconds)
+        self.count('tables_rendered')
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def slowest_tables(self, n=slowestTablesCount):
+        return sorted(self.tables.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def as_dict(self):
+        return {
+            'phases': self.phases,
+            'counters': self.counters,
+            'slowest_tables': self.slowest_tables(),
+        }
+
+    def summary(self):
+        lines = [
+            ', '.join('{} {:.3f}s'.format(name.capitalize(), seconds) for name, seconds in self.phases.items()),
+            ', '.join('{} {}'.format(value, exportCounters[counter]) for counter, value in self.counters.items()),
+        ]
+        if self.tables:
+            lines.append('Slowest tables: ' + ', '.join(
+                '{} {:.3f}s'.format(name, seconds) for name, seconds in self.slowest_tables(5)
+            ))
+
+        return '\n'.join(lines)
+
+
+class GrtReadCounter(object):
+    """Wraps a GRT object, counting the attributes read through it and the objects it leads to"""
+    __slots__ = ('_object', '_metrics')
+
+    def __init__(self, grt_object, metrics):
+        self._object = grt_object
+        self._metrics = metrics
+
+    def _wrap(self, value):
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        return GrtReadCounter(value, self._metrics)
+
+    def __getattr__(self, name):
+        self._metrics.count('grt_reads')
+        return self._wrap(getattr(self._object, name))
+
+    def __iter__(self):
+        for item in self._object:
+            yield self._wrap(item)
+
+    def __getitem__(self, index):
+        return self._wrap(self._object[index])
+
+    def __len__(self):
+        return len(self._object)
+
+    def __bool__(self):
+        return bool(self._object)
+
+
+def scan_migrations(path):
+    """Index the migrations in path by name in a single directory listing
+
+    Returns the number following the highest one of the migrations, which
+    numbers new migrations so that they run after every existing one, and a
+    dict of migration names (e.g. create_users_table) to their files.
+    """
+    number = 0
+    index = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.name.endswith('.php'):
+                continue
+
+            # Laravel names migrations {year}_{month}_{day}_{number}_{name}.php
+            parts = entry.name[:-len('.php')].split('_', 4)
+            if len(parts) == 5:
+                index.setdefault(parts[4], []).append(entry.path)
+                if parts[3].isdigit():
+                    number = max(number, int(parts[3]) + 1)
+
+    return number, index
+
+
+def save_snapshot(path, tables):
+    """Save the tables migrations were generated from to path, for diff mode"""
+    with open(os.path.join(path, snapshotFileName), 'w') as f:
+        json.dump({'version': pluginVersion, 'tables': [asdict(tbl) for tbl in tables.values()]}, f)
+
+
+def load_snapshot(path):
+    """The tables saved to path by save_snapshot, by name, or None without a usable snapshot"""
+    try:
+        with open(os.path.join(path, snapshotFileName)) as f:
+            snapshot = json.load(f)
+
+        tables = OrderedDict()
+        for tbl in snapshot['tables']:
+            tables[tbl['name']] = Table(
+                name=tbl['name'],
+                engine=tbl['engine'],
+                columns=[Column(**col) for col in tbl['columns']],
+                indices=[Index(**index) for index in tbl['indices']],
+                foreign_keys=[ForeignKey(**key) for key in tbl['foreign_keys']],
+                primary_column=tbl['primary_column'],
+                # Snapshots saved before the storage options were carried over
+                row_format=tbl.get('row_format', ''),
+                charset=tbl.get('charset', ''),
+                collation=tbl.get('collation', ''),
+                auto_increment=tbl.get('auto_increment', ''),
+                key_block_size=tbl.get('key_block_size', ''),
+                partitioning=load_partitioning(tbl.get('partitioning'))
+            )
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+    return tables
+
+
+def load_partitioning(partitioning):
+    if partitioning is None:
+        return None
+
+    definitions = [PartitionDefinition(**definition) for definition in partitioning.pop('definitions')]
+    return Partitioning(definitions=definitions, **partitioning)
+
+
+def read_manifest(path):
+    """The manifest save_migrations left in path, of any plugin version"""
+    try:
+        with open(os.path.join(path, manifestFileName)) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def load_manifest(path):
+    """Fingerprints of the migrations saved to path before that are still there"""
+    manifest = read_manifest(path)
+    if manifest.get('version') != pluginVersion:
+        return {}
 
+    index = scan_migrations(path)[1]
+    return dict((name, value) for name, value in manifest.get('migrations', {}).items() if name in index)
+
+
+def write_migration(file_name, data):
+    """Replace file_name with data unless it already holds exactly that, returning whether it was written"""
     try:
-        for schema in [(s, s.name == 'main') for s in catalog.schemata]:
-            table_tree = create_tree(schema[0])
-            migrations = export_schema(schema[0], table_tree)
+        if os.path.getsize(file_name) == len(data):
+            with open(file_name, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+
+    # Write next to the migration and swap it in, so an interrupted save
+    # never leaves a truncated migration behind
+    temp_name = os.path.join(os.path.dirname(file_name), '.' + os.path.basename(file_name) + '.tmp')
+    try:
+        with open(temp_name, 'wb') as f:
+            f.write(data)
+        os.replace(temp_name, file_name)
+    except OSError:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+    return True
+
+
+def migration_file_name(now, number, name):
+    """The file Laravel runs the migration name from, numbered number among those saved the day of now"""
+    return '{year}_{month}_{day}_{number}_{migrationName}.php'.format(
+        year=now.strftime('%Y'),
+        month=now.strftime('%m'),
+        day=now.strftime('%d'),
+        number=str(number).zfill(6),
+        migrationName=name
+    )
+
+
+def save_migrations(path, migrations, overwrite=True, metrics=None):
+    """Write the (migration, text) pairs of generate_migrations to path
+
+    Migrations overwrite the earlier migration of the same name, unless
+    overwrite is False: then each is saved to a new file and the manifest of
+    the overwritten migrations is left alone, as diff mode needs. Otherwise
+    the migrations of the last save that are no longer among them are removed.
+
+    Returns a summary counting the files written, skipped (already up to date),
+    created and removed, and the errors hit on the way.
+    """
+    errors = []
+    saved = {}
+    planned = set()
+    summary = {'written': 0, 'skipped': 0, 'created': 0, 'removed': 0}
+    if metrics is None:
+        metrics = ExportMetrics()
 
-    except GenerateLaravelMigrationsException as e:
-        grt.modules.Workbench.confirm(e.title, e.message)
-        return 1
+    try:
+        with metrics.phase('writing'):
+            i, index = scan_migrations(path)
+    except OSError as e:
+        return summary, [e]
 
     now = datetime.datetime.now()
-    for name in sorted(migrations):
-        save_format = '{year}_{month}_{day}_{number}_create_{tableName}_table.php'.format(
-            year=now.strftime('%Y'),
-            month=now.strftime('%m'),
-            day=now.strftime('%d'),
-            number="".zfill(6),
-            tableName=migration_tables[name]
-        )
-        out.write('Table name: {0}  Migration File: {1}\n\n'.format(migration_tables[name], save_format))
-        out.write(''.join(migrations[name]))
-        out.write('\n\n\n'.format(name))
+    for migration, text in migrations:
+        planned.add(migration.name)
+        if text is None:
+            # Unchanged since the last save
+            saved[migration.name] = migration.fingerprint
+            summary['skipped'] += 1
+            continue
+
+        start = time.perf_counter()
+        try:
+            data = text.encode('utf-8')
+
+            search = index.get(migration.name, []) if overwrite else []
+            for file in search:
+                if write_migration(file, data):
+                    summary['written'] += 1
+                    metrics.count('files_written')
+                    metrics.count('bytes_written', len(data))
+                else:
+                    summary['skipped'] += 1
+
+            if len(search) == 0:
+                write_migration(path + "/" + migration_file_name(now, i, migration.name), data)
+                summary['created'] += 1
+                metrics.count('files_written')
+                metrics.count('bytes_written', len(data))
+                i += 1
+
+            saved[migration.name] = migration.fingerprint
+
+        except (IOError, OSError) as e:
+            errors.append(e)
+
+        metrics.add_time('writing', time.perf_counter() - start)
+
+    if overwrite:
+        # E.g. the migrations of removed tables, or of dependency levels whose
+        # tables moved to other levels; they would create their tables again
+        for name, value in read_manifest(path).get('migrations', {}).items():
+            if name in planned:
+                continue
+
+            for file in index.get(name, []):
+                try:
+                    os.remove(file)
+                    summary['removed'] += 1
+                except OSError as e:
+                    errors.append(e)
+                    # Removed by the next save
+                    saved[name] = value
+
+        try:
+            with open(os.path.join(path, manifestFileName), 'w') as f:
+                json.dump({'version': pluginVersion, 'migrations': saved}, f, indent=1, sort_keys=True)
+        except IOError as e:
+            errors.append(e)
+
+    return summary, errors
+
+
+class ModelWatcher(object):
+    """Waits for model files to be saved, with inotify where the C library has it and by polling otherwise"""
+
+    def __init__(self, paths, poll=False):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.directories = {}
+        self.fd = None
+        if not poll:
+            try:
+                self.fd = self.inotify()
+            except (OSError, AttributeError, TypeError):
+                # No inotify on this platform
+                self.fd = None
+
+        self.stats = dict((path, model_stat(path)) for path in self.paths)
+
+    def inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        # Models are watched through their directories, since saving may
+        # replace the file rather than write to it
+        for directory in set(os.path.dirname(path) for path in self.paths):
+            wd = libc.inotify_add_watch(fd, directory.encode(sys.getfilesystemencoding()), inotifyMask)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed on "{}"'.format(directory))
+            self.directories[wd] = directory
+
+        return fd
+
+    def wait(self, timeout=None):
+        """The models saved within timeout seconds, or until one is with None; empty if none was"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            saved = self.read_events(remaining) if self.fd is not None else self.poll(remaining)
+            if saved or (deadline is not None and time.monotonic() >= deadline):
+                return saved
+
+    def read_events(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+
+        data = os.read(self.fd, 65536)
+        saved = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = inotifyEvent.unpack_from(data, offset)
+            offset += inotifyEvent.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(sys.getfilesystemencoding())
+            offset += length
+
+            path = os.path.join(self.directories.get(wd, ''), name)
+            if path in self.stats:
+                saved.add(path)
+
+        return saved
+
+    def poll(self, timeout):
+        time.sleep(watchPollInterval if timeout is None else min(watchPollInterval, timeout))
+
+        saved = set()
+        for path in self.paths:
+            stat = model_stat(path)
+            if stat != self.stats[path]:
+                self.stats[path] = stat
+                saved.add(path)
+
+        return saved
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def model_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def watch_models(args, cache=None):
+    """Export the models of args, then again each time one of them is saved, until interrupted
+
+    Parsed models stay in memory and only the saved ones are read again, and
+    so do the fingerprints of the migrations saved last: each save only
+    renders and writes the migrations of the tables that changed, and removes
+    those of the tables that were renamed or removed.
+    """
+    watcher = ModelWatcher(args.model, args.poll)
+    schemata = {}
+    unchanged = load_manifest(args.output) if args.incremental else None
 
-    sql_text = out.getvalue()
-    out.close()
+    sys.stderr.write('Watching {}{}, press Ctrl+C to stop\n'.format(
+        ', '.join(args.model), ' (polling)' if watcher.fd is None else ''
+    ))
 
-    wizard = GenerateLaravelMigrationWizard(sql_text)
-    wizard.run()
+    saved = set(watcher.paths)
+    try:
+        while True:
+            unchanged = watch_export(args, watcher.paths, saved, schemata, unchanged, cache)
+
+            # Wait for the models to stay untouched, as saving may take a few writes
+            saved = watcher.wait()
+            while True:
+                more = watcher.wait(args.debounce)
+                if not more:
+                    break
+                saved |= more
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
     return 0
 
 
+def watch_export(args, paths, saved, schemata, unchanged, cache):
+    """Export the models at paths once for watch_models, reading the saved ones again
+
+    Returns the fingerprints of the migrations now saved, by name.
+    """
+    metrics = ExportMetrics()
+    start = time.perf_counter()
+    with metrics.phase('loading'):
+        for path in saved:
+            try:
+                schemata[path] = load_mwb(path)
+            except modelReadErrors as e:
+                # Most likely read while still being saved; the end of the
+                # save triggers another export
+                sys.stderr.write('Could not read model "{}": {}\n'.format(path, str(e)))
+                schemata.pop(path, None)
+
+    if len(schemata) < len(paths):
+        return unchanged
+
+    try:
+        tables = catalog_tables([schema for path in paths for schema in schemata[path]])
+        if args.add_missing_indexes:
+            tables = add_missing_indexes(tables)
+        migrations = plan_export(tables, args, metrics)
+    except GenerateLaravelMigrationsException as e:
+        sys.stderr.write('{}\n{}\n'.format(e.title, e.message))
+        return unchanged
+
+    summary, errors = save_migrations(
+        args.output, generate_migrations(migrations, args.jobs, unchanged, cache, metrics), metrics=metrics
+    )
+    if cache is not None:
+        # Each save is a run of its own, so that other exports can use the
+        # cache meanwhile and a killed watch keeps what it rendered
+        cache.commit()
+    if not errors:
+        try:
+            save_snapshot(args.output, tables)
+        except IOError as e:
+            errors.append(e)
+    for e in errors:
+        sys.stderr.write('Could not save to file "{}": {}\n'.format(args.output, str(e)))
+
+    print('{} {} in {:.3f}s'.format(
+        datetime.datetime.now().strftime('%H:%M:%S'), saveSummaryTemplate.format(**summary), time.perf_counter() - start
+    ))
+    sys.stdout.flush()
+
+    if errors:
+        # Render everything again next time rather than trust a partial save
+        return None
+
+    return dict((migration.name, migration.fingerprint) for migration in migrations)
+
+
+def plan_export(tables, args, metrics):
+    """Plan the migrations of tables in the layout args ask for"""
+    if args.squash:
+        return plan_squashed(tables, metrics)
+    elif args.batch is not None:
+        return plan_batches(tables, args.defer_cycles, args.batch, metrics)
+
+    return plan_migrations(tables, args.defer_cycles, metrics)
+
+
+def open_cache(path, max_size=renderCacheSize):
+    if not path:
+        return None
+
+    try:
+        return RenderCache(path, max_size)
+    except sqlite3.Error as e:
+        sys.stderr.write('Could not open cache "{}", rendering without it: {}\n'.format(path, str(e)))
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export a MySQL Workbench model (.mwb) to Laravel migrations without MySQL Workbench.'
+    )
+    parser.add_argument('model', nargs='+',
+                        help='MySQL Workbench model file (.mwb); the schemata of several models are migrated together')
+    parser.add_argument('-o', '--output', default='.',
+                        help='directory to save the migrations to (default: current directory)')
+    parser.add_argument('--defer-cycles', action='store_true',
+                        help='defer foreign keys closing circular references to a separate migration')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes rendering migrations in parallel (default: 1)')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('-i', '--incremental', action='store_true',
+                      help='only regenerate the migrations of tables changed since the last save to the directory')
+    mode.add_argument('--diff', action='store_true',
+                      help='add migrations altering the tables saved to the directory last into the model, '
+                           'instead of regenerating their create migrations')
+    parser.add_argument('--squash', action='store_true',
+                        help='save a single migration creating the whole schema instead of one per table')
+    parser.add_argument('--batch', metavar='N', type=int, nargs='?', const=0,
+                        help='save one migration per dependency level, or per N tables, with the foreign keys '
+                             'inline')
+    parser.add_argument('--advice', metavar='FILE',
+                        help='write the indexing hazards the advisor finds per table to FILE as JSON')
+    parser.add_argument('--add-missing-indexes', action='store_true',
+                        help='add an index to each foreign key that is not migrated and has none')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='SQLite file to keep rendered migrations in between runs')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=renderCacheSize,
+                        help='size the cache is trimmed to after each run (default: {})'.format(renderCacheSize))
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='write the time spent per phase and table and the export counters to FILE as JSON')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the export with cProfile, saving the stats to FILE and listing the slowest '
+                             'tables; with --jobs only the main process is profiled')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep running, saving the migrations of the tables changed each time a model is saved')
+    parser.add_argument('--debounce', metavar='SECONDS', type=float, default=watchDebounce,
+                        help='with --watch, time a model has to stay untouched before it is exported again '
+                             '(default: {})'.format(watchDebounce))
+    parser.add_argument('--poll', action='store_true',
+                        help='with --watch, check the models for changes by polling instead of with inotify')
+    args = parser.parse_args(argv)
+    if args.squash and args.diff:
+        parser.error('argument --squash: not allowed with argument --diff')
+    if args.batch is not None and (args.squash or args.diff):
+        parser.error('argument --batch: not allowed with argument {}'.format('--squash' if args.squash else '--diff'))
+    if args.watch:
+        for option in ('diff', 'metrics', 'advice', 'profile'):
+            if getattr(args, option):
+                parser.error('argument --watch: not allowed with argument --{}'.format(option))
+
+        cache = open_cache(args.cache, args.cache_size)
+        try:
+            return watch_models(args, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    metrics = ExportMetrics()
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        profile.enable()
+
+    try:
+        unchanged = load_manifest(args.output) if args.incremental else None
+        with metrics.phase('loading'):
+            schemata = []
+            for model in args.model:
+                try:
+                    schemata.extend(load_mwb(model))
+                except modelReadErrors as e:
+                    sys.stderr.write('Could not read model "{}": {}\n'.format(model, str(e)))
+                    return 1
+            tables = catalog_tables(schemata)
+
+        advice = advise_tables(tables)
+        if args.add_missing_indexes:
+            tables = add_missing_indexes(tables)
+
+        if args.diff:
+            previous = load_snapshot(args.output)
+            if previous is None:
+                raise GenerateLaravelMigrationsException(
+                    'No snapshot found!',
+                    'Diff mode compares the model with the tables migrations were last saved from, but "{}" holds '
+                    'no snapshot of them. Save the migrations once without --diff first.'.format(args.output)
+                )
+            with metrics.phase('planning'):
+                migrations = plan_diff(previous, tables, args.defer_cycles)
+        else:
+            migrations = plan_export(tables, args, metrics)
+    except GenerateLaravelMigrationsException as e:
+        sys.stderr.write('{}\n{}\n'.format(e.title, e.message))
+        return 1
+
+    cache = open_cache(args.cache, args.cache_size)
+    summary, errors = save_migrations(
+        args.output, generate_migrations(migrations, args.jobs, unchanged, cache, metrics), not args.diff, metrics
+    )
+    if cache is not None:
+        cache.close()
+
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.profile)
+        sys.stderr.write('Slowest tables:\n')
+        for name, seconds in metrics.slowest_tables():
+            sys.stderr.write('  {:.4f}s  {}\n'.format(seconds, name))
+
+    if args.metrics:
+        try:
+            with open(args.metrics, 'w') as f:
+                json.dump(metrics.as_dict(), f, indent=1)
+        except IOError as e:
+            errors.append(e)
+
+    if advice:
+        sys.stderr.write('The advisor found {} indexing hazards in {} tables{}\n'.format(
+            sum(len(table_advice) for table_advice in advice.values()), len(advice),
+            '' if args.advice else ', run with --advice FILE to list them'
+        ))
+    if args.advice:
+        try:
+            with open(args.advice, 'w') as f:
+                json.dump(OrderedDict(
+                    (name, [{'kind': item.kind, 'message': item.message} for item in table_advice])
+                    for name, table_advice in advice.items()
+                ), f, indent=1)
+        except IOError as e:
+            errors.append(e)
+
+    if not errors:
+        try:
+            save_snapshot(args.output, tables)
+        except IOError as e:
+            errors.append(e)
+    for e in errors:
+        sys.stderr.write('Could not save to file "{}": {}\n'.format(args.output, str(e)))
+
+    print(saveSummaryTemplate.format(**summary))
+
+    return 1 if errors else 0
+
+
+if grt is not None:
+    ModuleInfo = DefineModule(
+        name='GenerateLaravelMigrations',
+        author='Carlos Herrera (caherrera), Pat Gagnon-Renaud (eXolnet), Brandon Eckenrode (beckenrode)',
+        version=pluginVersion
+    )
+
+    @ModuleInfo.plugin(
+        'wb.util.generate_laravel_migrations',
+        caption='Generate Laravel Migrations',
+        input=[wbinputs.currentCatalog()],
+        groups=['Catalog/Utilities', 'Menu/Catalog'],
+        pluginMenu='Catalog'
+    )
+    @ModuleInfo.export(grt.INT, grt.classes.db_Catalog)
+    def generate_laravel_migrations(catalog):
+        metrics = ExportMetrics()
+        with metrics.phase('snapshot'):
+            schemata = snapshot_catalog(GrtReadCounter(catalog, metrics))
+        cache_path = os.path.join(mforms.App.get().get_user_data_folder(), renderCacheFileName)
+
+        # Planning and rendering only read the snapshot, so they run on a
+        # worker thread while the UI thread shows their progress
+        defer_cycles = False
+        while True:
+            worker = ExportWorker(schemata, defer_cycles, metrics, cache_path=cache_path)
+            if not GenerateLaravelMigrationsProgressForm(worker).run():
+                return 1
+
+            e = worker.error
+            if e is None:
+                break
+
+            if isinstance(e, CircularReferenceException):
+                if defer_cycles or mforms.Utilities.show_message(
+                        e.title,
+                        e.message + '\n\nAlternatively, the foreign keys closing these circular references can be '
+                                    'deferred to a separate migration that runs after all tables are created.',
+                        'Defer Foreign Keys', 'Cancel', '') != mforms.ResultOk:
+                    return 1
+                defer_cycles = True
+
+            elif isinstance(e, GenerateLaravelMigrationsException):
+                grt.modules.Workbench.confirm(e.title, e.message)
+                return 1
+
+            else:
+                mforms.Utilities.show_error(
+                    'Generate Laravel Migrations',
+                    'Could not generate the migrations: {}: {}'.format(type(e).__name__, str(e)),
+                    'OK', '', ''
+                )
+                return 1
+
+        wizard = GenerateLaravelMigrationWizard(worker.rendered, worker.tables, metrics, cache_path)
+        wizard.run()
+
+        return 0
+
+
 class GenerateLaravelMigrationsException(Exception):
     def __init__(self, title, message):
         self.title = title
@@ -592,19 +2671,208 @@ class GenerateLaravelMigrationsException(Exception):
         return repr(self.title) + ': ' + repr(self.message)
 
 
+class CircularReferenceException(GenerateLaravelMigrationsException):
+    pass
+
+
+class ExportWorker(threading.Thread):
+    """Plans and renders the migrations of a catalog snapshot off the UI thread
+
+    Only touches the snapshot, never GRT objects. The UI thread polls progress
+    and status, and may cancel() between two tables. Given the tables already
+    cataloged, plans them in another of the migrationLayouts instead. With a
+    cache_path, migrations rendered before are taken from that RenderCache.
+    """
+
+    def __init__(self, schemata, defer_cycles, metrics, tables=None, layout=0, add_indexes=False, cache_path=None):
+        threading.Thread.__init__(self, name='generate-laravel-migrations')
+        self.daemon = True
+
+        self.schemata = schemata
+        self.defer_cycles = defer_cycles
+        self.metrics = metrics
+        self.layout = layout
+        self.add_indexes = add_indexes
+        self.cache_path = cache_path
+        self.cancelled = threading.Event()
+
+        self.progress = 0.0
+        self.status = 'Ordering tables...'
+        self.tables = tables
+        self.migrated_tables = None
+        self.rendered = []
+        self.error = None
+
+    def run(self):
+        # Opened on this thread, as SQLite connections stay on theirs
+        cache = open_cache(self.cache_path)
+        try:
+            if self.tables is None:
+                self.tables = catalog_tables(self.schemata)
+            self.migrated_tables = add_missing_indexes(self.tables) if self.add_indexes else self.tables
+
+            if self.layout == 1:
+                migrations = plan_batches(self.migrated_tables, self.defer_cycles, metrics=self.metrics)
+            elif self.layout == 2:
+                migrations = plan_squashed(self.migrated_tables, self.metrics)
+            else:
+                migrations = plan_migrations(self.migrated_tables, self.defer_cycles, self.metrics)
+
+            for migration, text in generate_migrations(migrations, cache=cache, metrics=self.metrics):
+                if self.cancelled.is_set():
+                    return
+
+                self.rendered.append((migration, text))
+                self.progress = len(self.rendered) / float(len(migrations))
+                self.status = 'Rendered {} ({} of {})'.format(migration.table, len(self.rendered), len(migrations))
+
+        except Exception as e:
+            # Shown on the UI thread; unexpected errors too, rather than
+            # opening the wizard with the migrations rendered so far
+            self.error = e
+
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class GenerateLaravelMigrationsProgressForm(Form):
+    def __init__(self, worker):
+        Form.__init__(self, None, mforms.FormDialogFrame)
+
+        self.worker = worker
+
+        self.set_title('Generate Laravel Migrations')
+
+        self.status_label = mforms.newLabel(worker.status)
+        self.progress_bar = mforms.newProgressBar()
+
+        self.cancel_button = mforms.newButton()
+        self.cancel_button.set_text('Cancel')
+
+        button_box = mforms.newBox(True)
+        button_box.set_spacing(12)
+        button_box.add_end(self.cancel_button, False, True)
+
+        content = mforms.newBox(False)
+        content.set_padding(12)
+        content.set_spacing(12)
+        content.add(self.status_label, False, True)
+        content.add(self.progress_bar, False, True)
+        content.add_end(button_box, False, True)
+
+        self.set_content(content)
+        self.set_size(420, 140)
+
+    def run(self):
+        """Show the progress of the worker until it is done, returning False if cancelled"""
+        self.worker.start()
+        timer = mforms.Utilities.add_timeout(progressPollInterval, self.poll)
+
+        if self.run_modal(None, self.cancel_button):
+            return True
+
+        mforms.Utilities.cancel_timeout(timer)
+        self.worker.cancel()
+        self.worker.join()
+        return False
+
+    def poll(self):
+        self.status_label.set_text(self.worker.status)
+        self.progress_bar.set_value(self.worker.progress)
+
+        if self.worker.is_alive():
+            return True
+
+        self.end_modal(True)
+        return False
+
+
 class GenerateLaravelMigrationsWizardPreviewPage(WizardPage):
-    def __init__(self, owner, sql_text):
+    def __init__(self, owner, rendered, tables, metrics, cache_path=None):
         WizardPage.__init__(self, owner, 'Review Generated Migrations')
 
+        # Only the layout on screen is kept rendered, which saving writes as is
+        self.rendered = rendered
+        self.layout = (0, False)
+        self.tables = self.migrated_tables = tables
+        self.metrics = metrics
+        self.cache_path = cache_path
+        self.advice = advise_tables(tables)
+
+        self.layout_selector = mforms.newSelector()
+        self.layout_selector.add_items(migrationLayouts)
+        self.layout_selector.set_tooltip('Fewer migrations load much faster when migrating fresh databases, '
+                                         'e.g. in test suites.')
+        self.layout_selector.add_changed_callback(self.layout_changed)
+
+        self.indexes_check = mforms.newCheckBox()
+        self.indexes_check.set_text('Add missing foreign key indexes')
+        self.indexes_check.set_tooltip('Add an index to each foreign key that is not migrated and has none.')
+        self.indexes_check.set_enabled(any(
+            item.kind == 'unindexed_foreign_key' for table_advice in self.advice.values() for item in table_advice
+        ))
+        self.indexes_check.add_clicked_callback(self.layout_changed)
+
         self.save_button = mforms.newButton()
         self.save_button.enable_internal_padding(True)
         self.save_button.set_text('Save Migrations to Directory...')
         self.save_button.set_tooltip('Select the directory to save your migrations to.')
         self.save_button.add_clicked_callback(self.save_clicked)
 
+        # Only the selected migration is put in the editor, which would take
+        # long to lay out the text of a whole catalog
+        self.migration_list = mforms.newTreeView(mforms.TreeFlatList)
+        self.migration_list.add_column(mforms.StringColumnType, 'Table name', 200, False)
+        self.migration_list.add_column(mforms.StringColumnType, 'Migration File', 400, False)
+        self.migration_list.end_columns()
+        self.migration_list.set_size(400, -1)
+        self.migration_list.add_changed_callback(self.migration_selected)
+
         self.sql_text = mforms.newCodeEditor()
         self.sql_text.set_language(mforms.LanguageMySQL)
-        self.sql_text.set_text(sql_text)
+
+        preview_start = time.perf_counter()
+        self.show_migrations()
+        metrics.add_time('preview', time.perf_counter() - preview_start)
+
+        self.metrics_panel = mforms.newPanel(mforms.TitledBoxPanel)
+        self.metrics_panel.set_title('Export Summary')
+        self.metrics_label = mforms.newLabel(metrics.summary())
+        self.metrics_panel.add(self.metrics_label)
+
+        self.advice_list = mforms.newTreeView(mforms.TreeFlatList)
+        self.advice_list.add_column(mforms.StringColumnType, 'Table name', 200, False)
+        self.advice_list.add_column(mforms.StringColumnType, 'Advice', 600, False)
+        self.advice_list.end_columns()
+        self.advice_list.set_size(-1, 120)
+        for name, table_advice in self.advice.items():
+            for item in table_advice:
+                node = self.advice_list.add_node()
+                node.set_string(0, name)
+                node.set_string(1, item.message)
+
+        self.advice_panel = mforms.newPanel(mforms.TitledBoxPanel)
+        self.advice_panel.set_title('Indexing Advice ({} found)'.format(
+            sum(len(table_advice) for table_advice in self.advice.values())
+        ))
+        self.advice_panel.add(self.advice_list)
+
+    def show_migrations(self):
+        self.migration_list.clear()
+
+        now = datetime.datetime.now()
+        for migration, text in self.rendered:
+            node = self.migration_list.add_node()
+            node.set_string(0, migration.table)
+            node.set_string(1, migration_file_name(now, 0, migration.name))
+
+        if self.rendered:
+            self.migration_list.select_node(self.migration_list.node_at_row(0))
+            self.migration_selected()
 
     def go_cancel(self):
         self.main.finish()
@@ -618,66 +2886,101 @@ class GenerateLaravelMigrationsWizardPreviewPage(WizardPage):
         # label = mforms.newLabel("Select the folder to save your migration(s) to.")
         # button_box.add(label, False, True)
         button_box.add(self.save_button, False, True)
+        button_box.add(self.layout_selector, False, True)
+        button_box.add(self.indexes_check, False, True)
+
+        preview_box = mforms.newBox(True)
+        preview_box.set_spacing(12)
+        preview_box.add(self.migration_list, False, True)
+        preview_box.add(self.sql_text, True, True)
 
         self.content.add_end(button_box, False, True)
-        self.content.add_end(self.sql_text, True, True)
+        self.content.add_end(self.metrics_panel, False, True)
+        self.content.add_end(self.advice_panel, False, True)
+        self.content.add_end(preview_box, True, True)
         # self.content.add_end(self.save_button, False, True)
 
         self.content.set_padding(12)
         self.content.set_spacing(12)
 
+    def migration_selected(self):
+        node = self.migration_list.get_selected_node()
+        if node is not None:
+            self.sql_text.set_text(self.preview_text(self.migration_list.row_for_node(node)))
+
+    def preview_text(self, row):
+        return self.rendered[row][1]
+
+    def layout_changed(self):
+        layout = (self.layout_selector.get_selected_index(), self.indexes_check.get_active())
+        if layout == self.layout:
+            return
+
+        # Planned and rendered off the UI thread like the first layout; circular
+        # references were only planned if their deferral was accepted, so they
+        # are deferred in every layout
+        worker = ExportWorker(None, True, self.metrics, self.tables, *layout, cache_path=self.cache_path)
+        cancelled = not GenerateLaravelMigrationsProgressForm(worker).run()
+        if not cancelled and worker.error is not None:
+            mforms.Utilities.show_error(
+                'Generate Laravel Migrations',
+                'Could not generate the migrations: {}: {}'.format(type(worker.error).__name__, str(worker.error)),
+                'OK', '', ''
+            )
+
+        if cancelled or worker.error is not None:
+            # Back to the layout still shown
+            self.layout_selector.set_selected(self.layout[0])
+            self.indexes_check.set_active(self.layout[1])
+            return
+
+        self.layout = layout
+        self.migrated_tables = worker.migrated_tables
+        self.rendered = worker.rendered
+        self.metrics_label.set_text(self.metrics.summary())
+        self.show_migrations()
+
     def save_clicked(self):
         file_chooser = mforms.newFileChooser(self.main, mforms.OpenDirectory)
 
         if file_chooser.run_modal() == mforms.ResultOk:
             path = file_chooser.get_path()
 
-            i = len(glob.glob(path + "/*_table.php"))
-            now = datetime.datetime.now()
-            for key in sorted(migrations):
+            summary, errors = save_migrations(path, iter(self.rendered), metrics=self.metrics)
+            self.metrics_label.set_text(self.metrics.summary())
+            if not errors:
                 try:
-                    search_format = "*_create_{tableName}_table.php".format(
-                        tableName=migration_tables[key]
-                    )
+                    save_snapshot(path, self.migrated_tables)
+                except IOError as e:
+                    errors.append(e)
 
-                    search = glob.glob(path + "/" + search_format)
-                    for file in search:
-                        with open(file, 'w+') as f:
-                            f.write(''.join(migrations[key]))
-
-                    if len(search) == 0:
-                        save_format = '{year}_{month}_{day}_{number}_create_{tableName}_table.php'.format(
-                            year=now.strftime('%Y'),
-                            month=now.strftime('%m'),
-                            day=now.strftime('%d'),
-                            number=str(i).zfill(6),
-                            tableName=migration_tables[key]
-                        )
-                        with open(path + "/" + save_format, 'w+') as f:
-                            f.write(''.join(migrations[key]))
-                            i += 1
+            for e in errors:
+                mforms.Utilities.show_error(
+                    'Save to File',
+                    'Could not save to file "%s": %s' % (path, str(e)),
+                    'OK', '', ''
+                )
 
-                except IOError as e:
-                    mforms.Utilities.show_error(
-                        'Save to File',
-                        'Could not save to file "%s": %s' % (path, str(e)),
-                        'OK', '', ''
-                    )
+            mforms.Utilities.show_message('Save to File', saveSummaryTemplate.format(**summary), 'OK', '', '')
 
 
 class GenerateLaravelMigrationWizard(WizardForm):
-    def __init__(self, sql_text):
+    def __init__(self, rendered, tables, metrics, cache_path=None):
         WizardForm.__init__(self, None)
 
         self.set_name('generate_laravel_migrations_wizard')
         self.set_title('Generate Laravel Migrations Wizard')
 
-        self.preview_page = GenerateLaravelMigrationsWizardPreviewPage(self, sql_text)
+        self.preview_page = GenerateLaravelMigrationsWizardPreviewPage(self, rendered, tables, metrics, cache_path)
         self.add_page(self.preview_page)
 
 
-try:
-    # For scripting shell
-    generate_laravel_migrations(grt.root.wb.doc.physicalModels[0].catalog)
-except Exception:
-    pass
+if grt is None:
+    if __name__ == '__main__':
+        sys.exit(main())
+else:
+    try:
+        # For scripting shell
+        generate_laravel_migrations(grt.root.wb.doc.physicalModels[0].catalog)
+    except Exception:
+        pass
@@ -0,0 +1,121 @@
+"""Tests of the migrations diff mode plans between two versions of a model
+
+    python -m unittest discover test
+"""
+import importlib.util
+import unittest
+import sys
+import os
+
+testPath = os.path.dirname(os.path.abspath(__file__))
+pluginPath = os.path.join(testPath, '..', 'generate-laravel-migrations.py')
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location('generate_laravel_migrations', pluginPath)
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+plugin = load_plugin()
+
+
+def column(name, type_name='BIGINT', type_group='numeric'):
+    return plugin.Column(name=name, type_name=type_name, type_group=type_group, flags=[], length=-1, precision=-1,
+                         scale=-1, is_not_null=1, default_value='', default_value_is_null=0, comment='',
+                         explicit_params='')
+
+
+def table(name, columns=(), indices=(), foreign_keys=()):
+    return plugin.Table(
+        name=name, engine='InnoDB', columns=[column('id')] + list(columns),
+        indices=[plugin.Index(name='PRIMARY', index_type='PRIMARY', is_primary=1, columns=['id'])] + list(indices),
+        foreign_keys=list(foreign_keys), primary_column='id', row_format='', charset='', collation='',
+        auto_increment='', key_block_size='', partitioning=None
+    )
+
+
+def unique(name, column_name):
+    return plugin.Index(name=name, index_type='UNIQUE', is_primary=0, columns=[column_name])
+
+
+def foreign_key(table_name, column_name, referenced_table, referenced_column='id'):
+    return plugin.ForeignKey(
+        name='fk_{}_{}'.format(table_name, column_name), columns=[column_name], referenced_table=referenced_table,
+        referenced_columns=[referenced_column], index_name='fk_{}_{}_idx'.format(table_name, column_name),
+        update_rule='CASCADE', delete_rule='CASCADE'
+    )
+
+
+def plan(previous, tables, defer_cycles=False):
+    return [migration.name for migration in plugin.plan_diff(previous, tables, defer_cycles)]
+
+
+class PlanDiffTest(unittest.TestCase):
+    def test_same_model_plans_nothing(self):
+        tables = plugin.catalog_tables(plugin.load_mwb(os.path.join(testPath, 'Test.mwb')))
+        self.assertEqual(plan(tables, plugin.catalog_tables(plugin.load_mwb(os.path.join(testPath, 'Test.mwb')))), [])
+
+    def test_new_table_is_created_after_the_column_it_references_is_added(self):
+        previous = {'users': table('users')}
+        tables = {
+            'users': table('users', [column('code', 'VARCHAR', 'string')], [unique('code_UNIQUE', 'code')]),
+            'orders': table('orders', [column('user_code', 'VARCHAR', 'string')],
+                            foreign_keys=[foreign_key('orders', 'user_code', 'users', 'code')]),
+        }
+
+        # Rolled back in reverse, orders is dropped before users drops code
+        self.assertEqual(plan(previous, tables), ['update_users_table', 'create_orders_table'])
+
+    def test_foreign_keys_are_added_after_every_update(self):
+        previous = {'accounts': table('accounts'), 'users': table('users')}
+        tables = {
+            'accounts': table('accounts', [column('user_code', 'VARCHAR', 'string')],
+                              foreign_keys=[foreign_key('accounts', 'user_code', 'users', 'code')]),
+            'users': table('users', [column('code', 'VARCHAR', 'string')], [unique('code_UNIQUE', 'code')]),
+        }
+
+        migrations = plugin.plan_diff(previous, tables)
+        self.assertEqual([migration.name for migration in migrations],
+                         ['update_accounts_table', 'update_users_table', 'add_changed_foreign_keys'])
+        self.assertNotIn('foreign(', plugin.render_migration(migrations[0]))
+        self.assertIn("references('code')->on('users')", plugin.render_migration(migrations[2]))
+
+    def test_foreign_keys_are_dropped_before_every_update(self):
+        previous = {
+            'accounts': table('accounts', [column('user_code', 'VARCHAR', 'string')],
+                              foreign_keys=[foreign_key('accounts', 'user_code', 'users', 'code')]),
+            'users': table('users', [column('code', 'VARCHAR', 'string')], [unique('code_UNIQUE', 'code')]),
+        }
+        tables = {'accounts': table('accounts'), 'users': table('users')}
+
+        migrations = plugin.plan_diff(previous, tables)
+        self.assertEqual([migration.name for migration in migrations],
+                         ['drop_changed_foreign_keys', 'update_accounts_table', 'update_users_table'])
+        self.assertIn("dropForeign(['user_code'])", plugin.render_migration(migrations[0]))
+
+    def test_removed_tables_are_dropped_before_the_tables_they_reference(self):
+        previous = {
+            'users': table('users'),
+            'posts': table('posts', [column('user_id')], foreign_keys=[foreign_key('posts', 'user_id', 'users')]),
+            'comments': table('comments', [column('post_id')],
+                              foreign_keys=[foreign_key('comments', 'post_id', 'posts')]),
+        }
+
+        self.assertEqual(plan(previous, {}), ['drop_comments_table', 'drop_posts_table', 'drop_users_table'])
+
+    def test_circular_references_of_new_tables_are_deferred(self):
+        tables = {
+            'a': table('a', [column('b_id')], foreign_keys=[foreign_key('a', 'b_id', 'b')]),
+            'b': table('b', [column('a_id')], foreign_keys=[foreign_key('b', 'a_id', 'a')]),
+        }
+
+        with self.assertRaises(plugin.CircularReferenceException):
+            plan({}, tables)
+        self.assertEqual(plan({}, tables, True)[-1], plugin.deferredForeignKeysMigrationName)
+
+
+if __name__ == '__main__':
+    unittest.main()